@@ -0,0 +1,35 @@
+import asyncio
+from aiohttp import web
+
+MJPEG_CONTENT_TYPE = 'multipart/x-mixed-replace;boundary=frame'
+
+
+def mjpeg_part(frame):
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + frame +
+            b'\r\n\r\n')
+
+
+async def stream_mjpeg(request, subscription, poll_interval=0.5):
+    """
+    Send the frames of a source subscription as a multipart response.
+
+    The wait for the next frame is awaited on the event loop, which is woken
+    up by the thread putting the frame, so a stream holds no thread at all:
+    the loop only writes the parts to the client. The caller is responsible
+    for removing the subscription afterwards.
+    """
+    response = web.StreamResponse(headers={'Content-Type': MJPEG_CONTENT_TYPE})
+    await response.prepare(request)
+    subscription.attach_loop(asyncio.get_event_loop())
+
+    try:
+        while not subscription.is_closed():
+            frame = await subscription.get_async(timeout=poll_interval)
+            if frame is None:
+                continue
+            await response.write(mjpeg_part(frame))
+    except ConnectionResetError:
+        # the client went away
+        pass
+    return response
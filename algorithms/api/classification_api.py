@@ -1,13 +1,35 @@
 from flask import Blueprint, request
 import numpy as np
-from .service.classification_service import videos_classification
+from .service.classification_service import videos_classification, clips_classification
+from .service.classification_transport import read_shared_clips
 
 classification_api = Blueprint('classification_api', __name__)
 
 
+@classification_api.errorhandler(ValueError)
+def invalid_clips(e):
+    return {'error': str(e)}, 400
+
+
 @classification_api.route('/video_classification', methods=['POST'])
 def video_classification():
     file = request.files['file']
     npzfile = np.load(file)
 
     return videos_classification(npzfile)
+
+
+@classification_api.route('/video_classification/raw', methods=['POST'])
+def video_classification_raw():
+    shape = tuple(int(dim) for dim in request.headers['X-Clip-Shape'].split(','))
+    clips = np.frombuffer(request.get_data(), np.uint8).reshape(shape)
+
+    return clips_classification(clips)
+
+
+@classification_api.route('/video_classification/shm', methods=['POST'])
+def video_classification_shm():
+    body = request.get_json()
+    clips = read_shared_clips(body['name'], body['shape'])
+
+    return clips_classification(clips)
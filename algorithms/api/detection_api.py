@@ -1,5 +1,5 @@
 from flask import Blueprint, request
-from .service.detection_service import get_video_with_tracking_objects
+from .service.detection_service import get_video_with_tracking_objects, get_sessions_stats
 
 detection_api = Blueprint('detection_api', __name__)
 
@@ -13,3 +13,8 @@ def youtube_video(video_id, user_id, detection_process_id):
 def camera_video(user_id, detection_process_id):
     video_addr = request.args.get("video_addr")
     return get_video_with_tracking_objects(video_addr, user_id, detection_process_id, type='video')
+
+
+@detection_api.route('/sessions')
+def sessions():
+    return get_sessions_stats()
@@ -0,0 +1,39 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from .async_streaming import stream_mjpeg
+from .service.detection_service import open_tracking_subscription, close_tracking_subscription, get_sessions_stats
+import config
+
+detection_async_api = web.RouteTableDef()
+
+# opening a source connects to it and closing one joins its workers, neither may block the event loop
+blocking_executor = ThreadPoolExecutor(max_workers=config.async_blocking_workers, thread_name_prefix='source')
+
+
+async def video_with_tracking_objects(request, video_id, type):
+    user_id = request.match_info['user_id']
+    detection_process_id = request.match_info['detection_process_id']
+
+    loop = asyncio.get_event_loop()
+    subscription = await loop.run_in_executor(blocking_executor, open_tracking_subscription,
+                                              video_id, user_id, detection_process_id, type)
+    try:
+        return await stream_mjpeg(request, subscription)
+    finally:
+        await loop.run_in_executor(blocking_executor, close_tracking_subscription, subscription)
+
+
+@detection_async_api.get('/youtube_video/{video_id}/{user_id}/{detection_process_id}')
+async def youtube_video(request):
+    return await video_with_tracking_objects(request, request.match_info['video_id'], type='youtube')
+
+
+@detection_async_api.get('/video_camera/{user_id}/{detection_process_id}')
+async def camera_video(request):
+    return await video_with_tracking_objects(request, request.query.get('video_addr'), type='video')
+
+
+@detection_async_api.get('/sessions')
+async def sessions(request):
+    return web.json_response(get_sessions_stats())
@@ -0,0 +1,82 @@
+import numpy as np
+from threading import Lock
+
+
+class ClipStore:
+    """
+    Keeps the last `clip_length` frames of every live track in a preallocated
+    uint8 ring buffer, so memory is bounded by the number of live tracks and
+    not by the duration of the stream.
+
+    Every frame is written twice, at `i` and `i + clip_length`, so the last
+    `clip_length` frames are always a contiguous, ordered slice of the buffer.
+
+    Parameters
+    ----------
+    clip_length : int
+        Number of frames in a clip.
+    frame_shape : (int, int, int)
+        Shape of a single frame.
+
+    """
+
+    def __init__(self, clip_length=8, frame_shape=(112, 112, 3)):
+        self.clip_length = clip_length
+        self.frame_shape = tuple(frame_shape)
+
+        # track id -> [buffer of shape (2 * clip_length, *frame_shape), number of appended frames]
+        self.clips = {}
+        self.lock = Lock()
+
+    def append(self, track_id, frame):
+        with self.lock:
+            entry = self.clips.get(track_id)
+            if entry is None:
+                entry = [np.zeros((2 * self.clip_length,) + self.frame_shape, np.uint8), 0]
+                self.clips[track_id] = entry
+
+            buffer, count = entry
+            i = count % self.clip_length
+            buffer[i] = frame
+            buffer[i + self.clip_length] = frame
+            entry[1] = count + 1
+
+    def get(self, track_id):
+        """Return a view of the last `clip_length` frames of a track or None if the clip is not full yet.
+
+        The view is overwritten by later appends, use `get_clips` to hand clips to another thread.
+        """
+        with self.lock:
+            return self._view(track_id)
+
+    def get_clips(self):
+        """Return the ids of all tracks with a full clip and a copy of their clips stacked into one array."""
+        with self.lock:
+            track_ids = [track_id for track_id in self.clips if self.clips[track_id][1] >= self.clip_length]
+            if len(track_ids) == 0:
+                return [], None
+            return track_ids, np.stack([self._view(track_id) for track_id in track_ids])
+
+    def reset(self, track_id):
+        """Start collecting a new clip for a track."""
+        with self.lock:
+            if track_id in self.clips:
+                self.clips[track_id][1] = 0
+
+    def evict(self, live_track_ids):
+        """Drop the buffers of all tracks that are not in `live_track_ids`."""
+        live_track_ids = set(live_track_ids)
+        with self.lock:
+            for track_id in [track_id for track_id in self.clips if track_id not in live_track_ids]:
+                del self.clips[track_id]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.clips)
+
+    def _view(self, track_id):
+        entry = self.clips.get(track_id)
+        if entry is None or entry[1] < self.clip_length:
+            return None
+        start = entry[1] % self.clip_length
+        return entry[0][start:start + self.clip_length]
@@ -0,0 +1,157 @@
+import json
+import math
+import struct
+import time
+from threading import Lock
+
+JSON = 'json'
+BINARY = 'binary'
+
+ALWAYS = 'always'
+CHANGES = 'changes'
+
+EVENT_FORMAT_VERSION = 1
+EVENT_MAGIC = b'AV'
+EVENT_TYPES = {'OBJECT_DETECTION': 1, 'TRACK_STARTED': 2, 'TRACK_UPDATED': 3, 'EVENT_CLASSIFIED': 4, 'TRACK_ENDED': 5}
+
+# magic, version, type, iteration, numObject, score, box (x1, y1, x2, y2), eventAccuracy
+_HEADER = struct.Struct('<2sBBIIf4ff')
+_SHORT_STRING = struct.Struct('<H')
+_LONG_STRING = struct.Struct('<I')
+_SHORT_FIELDS = ('userId', 'processId', 'class', 'eventClass', 'eventTime')
+
+
+class JsonEventEncoder:
+    content_type = 'application/json'
+
+    def encode(self, message):
+        return json.dumps(message).encode('utf-8')
+
+
+class BinaryEventEncoder:
+    """
+    Packs a detection event into a fixed header with the numeric fields and
+    length prefixed utf-8 strings. Missing values are packed as NaN or empty
+    strings. The layout is identified by `EVENT_MAGIC` and `EVENT_FORMAT_VERSION`.
+    """
+
+    content_type = 'application/x-detection-event'
+
+    def encode(self, message):
+        attributes = message['attributes']
+        accuracy = attributes.get('eventAccuracy')
+        parts = [_HEADER.pack(EVENT_MAGIC, EVENT_FORMAT_VERSION, EVENT_TYPES[message['type']],
+                              attributes['iteration'], attributes['numObject'], attributes['score'],
+                              *attributes['box'], math.nan if accuracy is None else accuracy)]
+
+        for name in _SHORT_FIELDS:
+            value = (attributes.get(name) or '').encode('utf-8')
+            parts.append(_SHORT_STRING.pack(len(value)))
+            parts.append(value)
+
+        image = (attributes.get('image') or '').encode('ascii')
+        parts.append(_LONG_STRING.pack(len(image)))
+        parts.append(image)
+        return b''.join(parts)
+
+
+def decode_binary_event(data):
+    """Unpack an event packed by `BinaryEventEncoder` into the dictionary layout of the JSON format."""
+    magic, version, event_type, iteration, num_object, score, x1, y1, x2, y2, accuracy = _HEADER.unpack_from(data)
+    if magic != EVENT_MAGIC or version != EVENT_FORMAT_VERSION:
+        raise ValueError(f'unsupported event format {magic} {version}')
+
+    attributes = {'iteration': iteration, 'numObject': num_object, 'score': score, 'box': (x1, y1, x2, y2),
+                  'eventAccuracy': None if math.isnan(accuracy) else accuracy}
+    offset = _HEADER.size
+    for name in _SHORT_FIELDS:
+        length, = _SHORT_STRING.unpack_from(data, offset)
+        offset += _SHORT_STRING.size
+        attributes[name] = data[offset:offset + length].decode('utf-8') or None
+        offset += length
+
+    length, = _LONG_STRING.unpack_from(data, offset)
+    offset += _LONG_STRING.size
+    attributes['image'] = data[offset:offset + length].decode('ascii') or None
+
+    types = {code: name for name, code in EVENT_TYPES.items()}
+    return {'type': types[event_type], 'attributes': attributes}
+
+
+def create_event_encoder(event_format):
+    if event_format == JSON:
+        return JsonEventEncoder()
+    elif event_format == BINARY:
+        return BinaryEventEncoder()
+    else:
+        raise Exception(f'undefined event format {event_format}')
+
+
+class ImagePolicy:
+    """
+    Decides per track whether an event carries the crop image. With the
+    `changes` policy an image is attached when a track is seen for the first
+    time, when its event class changes and when a better shot appears: a
+    score higher by `score_margin` or a box larger by `area_margin`. With the
+    `always` policy every event carries an image.
+    """
+
+    def __init__(self, policy=CHANGES, score_margin=0.05, area_margin=0.2):
+        if policy not in (ALWAYS, CHANGES):
+            raise ValueError(f'undefined image policy {policy}')
+
+        self.policy = policy
+        self.score_margin = score_margin
+        self.area_margin = area_margin
+
+        # track id -> [event class, best score, best box area]
+        self.tracks = {}
+
+    def should_attach(self, track_id, score, box, event_class=None):
+        x1, y1, x2, y2 = box
+        area = max(x2 - x1, 0) * max(y2 - y1, 0)
+
+        state = self.tracks.get(track_id)
+        if state is None:
+            self.tracks[track_id] = [event_class, score, area]
+            return True
+
+        attach = self.policy == ALWAYS
+        if event_class is not None and event_class != state[0]:
+            state[0] = event_class
+            attach = True
+        if score > state[1] + self.score_margin or area > state[2] * (1 + self.area_margin):
+            attach = True
+
+        if attach:
+            state[1] = max(state[1], score)
+            state[2] = max(state[2], area)
+        return attach
+
+    def evict(self, live_track_ids):
+        live_track_ids = set(live_track_ids)
+        for track_id in [track_id for track_id in self.tracks if track_id not in live_track_ids]:
+            del self.tracks[track_id]
+
+
+class ByteRateCounter:
+    """Counts published messages, bytes and attached images of one stream."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.messages = 0
+        self.bytes = 0
+        self.images = 0
+        self.start_time = time.time()
+
+    def add(self, size, image=False):
+        with self.lock:
+            self.messages += 1
+            self.bytes += size
+            self.images += int(image)
+
+    def get_stats(self):
+        with self.lock:
+            elapsed = time.time() - self.start_time
+            return {'messages': self.messages, 'bytes': self.bytes, 'images': self.images,
+                    'bytes_per_second': self.bytes / elapsed if elapsed > 0 else 0.}
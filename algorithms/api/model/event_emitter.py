@@ -0,0 +1,82 @@
+from collections import Counter
+
+OBJECT_DETECTION = 'OBJECT_DETECTION'
+TRACK_STARTED = 'TRACK_STARTED'
+TRACK_UPDATED = 'TRACK_UPDATED'
+EVENT_CLASSIFIED = 'EVENT_CLASSIFIED'
+TRACK_ENDED = 'TRACK_ENDED'
+
+FRAMES = 'frames'
+CHANGES = 'changes'
+
+
+class EventEmitter:
+    """
+    Decides which messages are published for the tracks of a stream.
+
+    In the `changes` mode a track emits `TRACK_STARTED` when it is seen for
+    the first time, `EVENT_CLASSIFIED` when a new event class arrives for it,
+    `TRACK_UPDATED` every `update_interval` frames or as soon as its box
+    center moved by more than `min_displacement` of the box size since the
+    last message, and `TRACK_ENDED` when the tracker deleted it. In the
+    `frames` mode every track emits `OBJECT_DETECTION` on every frame.
+    """
+
+    def __init__(self, mode=CHANGES, update_interval=30, min_displacement=0.2):
+        if mode not in (FRAMES, CHANGES):
+            raise ValueError(f'undefined emission mode {mode}')
+
+        self.mode = mode
+        self.update_interval = update_interval
+        self.min_displacement = min_displacement
+
+        # track id -> [box of the last message, frames since the last message, last attributes]
+        self.tracks = {}
+        self.emitted = Counter()
+
+    def observe(self, track_id, attributes, force_update=False):
+        """Return the types of the messages to publish for a track seen in the current frame."""
+        if self.mode == FRAMES:
+            self.emitted[OBJECT_DETECTION] += 1
+            return [OBJECT_DETECTION]
+
+        box = attributes['box']
+        types = []
+        state = self.tracks.get(track_id)
+        if state is None:
+            state = [box, 0, attributes]
+            self.tracks[track_id] = state
+            types.append(TRACK_STARTED)
+        else:
+            state[1] += 1
+            state[2] = attributes
+
+        if attributes.get('eventClass') is not None:
+            types.append(EVENT_CLASSIFIED)
+        if len(types) == 0 and (force_update or state[1] >= self.update_interval or self._moved(state[0], box)):
+            types.append(TRACK_UPDATED)
+
+        if len(types) > 0:
+            state[0] = box
+            state[1] = 0
+            self.emitted.update(types)
+        return types
+
+    def end(self, live_track_ids):
+        """Forget tracks that are not in `live_track_ids`, returns (track id, last attributes) of every one."""
+        live_track_ids = set(live_track_ids)
+        ended = [(track_id, state[2]) for track_id, state in self.tracks.items() if track_id not in live_track_ids]
+        for track_id, _ in ended:
+            del self.tracks[track_id]
+        self.emitted[TRACK_ENDED] += len(ended)
+        return ended
+
+    def get_stats(self):
+        return dict(self.emitted, tracks=len(self.tracks))
+
+    def _moved(self, old_box, new_box):
+        x1, y1, x2, y2 = old_box
+        size = max(x2 - x1, y2 - y1, 1)
+        dx = (new_box[0] + new_box[2] - x1 - x2) / 2
+        dy = (new_box[1] + new_box[3] - y1 - y2) / 2
+        return (dx * dx + dy * dy) ** 0.5 > self.min_displacement * size
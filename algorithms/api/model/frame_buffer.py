@@ -0,0 +1,174 @@
+import time
+from threading import Condition
+
+LATEST = 'latest'
+EVERY_NTH = 'every_nth'
+ADAPTIVE = 'adaptive'
+
+
+class FrameBuffer:
+    """
+    Ring buffer of the last captured frames. Every frame gets a sequence number
+    and a capture timestamp, so a frame is never delivered twice and frames
+    older than `max_frame_age` are never delivered at all.
+
+    Parameters
+    ----------
+    size : int
+        Number of frames kept in the ring.
+    policy : str
+        Which frame `get` delivers next:
+        * `latest` - the newest captured frame.
+        * `every_nth` - every `every_nth` captured frame.
+        * `adaptive` - skips as many frames as needed to keep up with the
+          consumer, estimated from the capture interval and the time the
+          consumer spends on a frame between two `get` calls. The time
+          `get` waits for the next frame is not counted, so the step drops
+          back as soon as the consumer is fast again.
+    every_nth : int
+        Step of the `every_nth` policy.
+    max_frame_age : Optional[float]
+        Frames older than this number of seconds are dropped as stale.
+
+    Attributes
+    ----------
+    captured : int
+        Number of frames put into the buffer.
+    delivered : int
+        Number of frames returned by `get`.
+    dropped : int
+        Number of captured frames that were skipped and never delivered.
+    stale : int
+        Number of times frames were dropped because they exceeded `max_frame_age`.
+    duplicated : int
+        Number of `get` calls that found no new frame, i.e. the frames that
+        would otherwise have been processed twice.
+    expired : int
+        Number of delivered frames that exceeded `max_frame_age` later on,
+        e.g. while waiting in the queues of a pipeline, see `check_age`.
+
+    """
+
+    def __init__(self, size=8, policy=LATEST, every_nth=2, max_frame_age=0.5):
+        if policy not in (LATEST, EVERY_NTH, ADAPTIVE):
+            raise ValueError(f'undefined frame policy {policy}')
+
+        self.size = size
+        self.policy = policy
+        self.every_nth = max(1, every_nth)
+        self.max_frame_age = max_frame_age
+
+        self.frames = [None] * size
+        self.seq = 0
+        self.last_read_seq = 0
+        self.condition = Condition()
+
+        self.capture_interval = None
+        self.consume_interval = None
+        self.last_put_time = None
+        self.last_get_time = None
+
+        self.captured = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.stale = 0
+        self.duplicated = 0
+        self.expired = 0
+
+    def put(self, frame):
+        timestamp = time.time()
+        with self.condition:
+            self.seq += 1
+            self.frames[self.seq % self.size] = (self.seq, timestamp, frame)
+            self.captured += 1
+            self.capture_interval = self._smooth(self.capture_interval, self.last_put_time, timestamp)
+            self.last_put_time = timestamp
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        """Return the next `(seq, timestamp, frame)` according to the policy or None on timeout."""
+        call_time = time.time()
+        deadline = None if timeout is None else call_time + timeout
+        with self.condition:
+            # time spent on the previous frame, excluding the wait inside `get`
+            self.consume_interval = self._smooth(self.consume_interval, self.last_get_time, call_time)
+            self.last_get_time = None
+            if self.seq <= self.last_read_seq:
+                self.duplicated += 1
+
+            entry = self._select()
+            while entry is None:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+                entry = self._select()
+
+            seq, timestamp, _ = entry
+            if self.last_read_seq > 0:
+                self.dropped += seq - self.last_read_seq - 1
+            self.last_read_seq = seq
+            self.delivered += 1
+            self.last_get_time = time.time()
+            return entry
+
+    def check_age(self, timestamp):
+        """Return False and count the frame as expired if a frame captured at `timestamp` exceeds `max_frame_age`."""
+        if self.max_frame_age is None or time.time() - timestamp <= self.max_frame_age:
+            return True
+        with self.condition:
+            self.expired += 1
+        return False
+
+    def get_stats(self):
+        with self.condition:
+            return {'policy': self.policy, 'captured': self.captured, 'delivered': self.delivered,
+                    'dropped': self.dropped, 'stale': self.stale, 'duplicated': self.duplicated,
+                    'expired': self.expired, 'step': self._step()}
+
+    def _step(self):
+        if self.policy == EVERY_NTH:
+            return self.every_nth
+        if self.policy == ADAPTIVE and self.capture_interval and self.consume_interval:
+            return max(1, int(round(self.consume_interval / self.capture_interval)))
+        return 1
+
+    def _select(self):
+        if self.seq <= self.last_read_seq:
+            return None
+
+        if self.policy == LATEST:
+            target = self.seq
+        else:
+            target = self.last_read_seq + self._step()
+            if target > self.seq:
+                return None
+            if target <= self.seq - self.size:
+                # the frame was already overwritten in the ring
+                target = self.seq
+
+        entry = self.frames[target % self.size]
+        if self._is_stale(entry) and target != self.seq:
+            self.stale += 1
+            target = self.seq
+            entry = self.frames[target % self.size]
+
+        if self._is_stale(entry):
+            # even the newest frame is too old, drop everything and wait for a fresh one
+            self.stale += 1
+            if self.last_read_seq > 0:
+                self.dropped += self.seq - self.last_read_seq
+            self.last_read_seq = self.seq
+            return None
+
+        return entry
+
+    def _is_stale(self, entry):
+        return self.max_frame_age is not None and time.time() - entry[1] > self.max_frame_age
+
+    @staticmethod
+    def _smooth(value, last_time, current_time, alpha=0.1):
+        if last_time is None:
+            return value
+        interval = current_time - last_time
+        return interval if value is None else (1 - alpha) * value + alpha * interval
@@ -0,0 +1,112 @@
+import logging
+from queue import Queue, Empty
+from threading import Thread, Event, BoundedSemaphore
+
+
+class PipelineStage:
+    """
+    One step of a frame pipeline running on its own worker thread.
+
+    The worker takes items from `input_queue`, applies `fn` and puts the result
+    into `output_queue`. Work is done on demand: the worker reserves a place
+    in `output_queue` (one of `output_credits`) before it takes an input, so a
+    slow stage applies backpressure to the stages before it and no finished
+    item ever waits inside a worker for room downstream. A place taken from
+    `input_queue` is handed back through `input_credits`.
+    If `fn` is a source (`input_queue` is None) it is called without arguments.
+    If `fn` returns None the item is dropped.
+
+    """
+
+    def __init__(self, name, fn, input_queue, output_queue, stop_event,
+                 input_credits=None, output_credits=None, timeout=0.1):
+        self.name = name
+        self.fn = fn
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.input_credits = input_credits
+        self.output_credits = output_credits
+        self.stop_event = stop_event
+        self.timeout = timeout
+
+        self.thread = Thread(target=self.run, name=name)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if not self.output_credits.acquire(timeout=self.timeout):
+                continue
+
+            if self.input_queue is None:
+                item = None
+            else:
+                try:
+                    item = self.input_queue.get(timeout=self.timeout)
+                except Empty:
+                    self.output_credits.release()
+                    continue
+                self.input_credits.release()
+
+            try:
+                result = self.fn() if self.input_queue is None else self.fn(item)
+            except Exception as e:
+                logging.error(f'{self.name}: {e}')
+                result = None
+
+            if result is None:
+                self.output_credits.release()
+            else:
+                self.output_queue.put_nowait(result)
+
+
+class FramePipeline:
+    """
+    A chain of stages connected by bounded queues.
+
+    Each stage works on its own thread, so CPU stages of one frame overlap
+    with inference of the next and the end-to-end throughput is bounded by
+    the slowest stage rather than by the sum of all stages. A stage only
+    starts on an item when there is room for its result, so a source
+    behind a slow stage is read when that stage is about to need the item,
+    not when the previous item was read.
+
+    Parameters
+    ----------
+    source : Callable[] -> object
+        Produces the next item, e.g. reads a frame from a camera.
+    stages : List[(str, Callable[object] -> object)]
+        Named functions applied in order to every item.
+    queue_size : int
+        Capacity of every queue between two stages.
+
+    """
+
+    def __init__(self, source, stages, queue_size=2):
+        self.stop_event = Event()
+
+        self.queues = [Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+        self.credits = [BoundedSemaphore(queue_size) for _ in self.queues]
+        self.stages = [PipelineStage('capture', source, None, self.queues[0], self.stop_event,
+                                     output_credits=self.credits[0])]
+        for i, (name, fn) in enumerate(stages):
+            self.stages.append(PipelineStage(name, fn, self.queues[i], self.queues[i + 1], self.stop_event,
+                                             self.credits[i], self.credits[i + 1]))
+
+        for stage in self.stages:
+            stage.start()
+
+    def get(self, timeout=None):
+        item = self.queues[-1].get(timeout=timeout)
+        self.credits[-1].release()
+        return item
+
+    def stop(self, timeout=1.):
+        self.stop_event.set()
+        for stage in self.stages:
+            stage.thread.join(timeout)
+
+    def is_running(self):
+        return not self.stop_event.is_set()
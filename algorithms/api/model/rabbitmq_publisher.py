@@ -0,0 +1,211 @@
+import logging
+import time
+import pika
+from collections import deque
+from threading import Thread, Condition
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+
+
+class RabbitMQPublisher:
+    """
+    Publishes messages to an exchange over one long-lived connection from a
+    background thread.
+
+    Messages are buffered and sent in batches once `batch_size` messages are
+    pending or `flush_interval` seconds have passed. While nothing is sent
+    the connection is still serviced every `flush_interval`, so heartbeats
+    are answered and an idle connection is not dropped by the broker. If the
+    connection fails the messages of the batch that were not published yet
+    are put back into the buffer and the publisher reconnects after
+    `reconnect_interval` seconds. The buffer holds at most `buffer_size`
+    messages; when it is full either the oldest or the newest message is
+    dropped.
+
+    Parameters
+    ----------
+    addr : str
+        AMQP URL of the broker.
+    exchange : str
+        Exchange the messages are published to.
+    routing_key : str
+        Routing key of the messages.
+    batch_size : int
+        Maximum number of messages sent in one batch.
+    flush_interval : float
+        Maximum time in seconds a message waits in the buffer.
+    confirm : bool
+        If True, the channel is put into confirm mode and every message waits
+        for the broker to acknowledge it. Only then a failed batch is retried
+        without duplicates, otherwise messages written to a connection that
+        fails right after may be lost.
+    buffer_size : int
+        Maximum number of pending messages.
+    drop_policy : str
+        `drop_oldest` or `drop_newest`, which message to drop if the buffer is full.
+    reconnect_interval : float
+        Time in seconds to wait before reconnecting.
+    connection_factory : Optional[Callable[] -> pika.BlockingConnection]
+        Creates a new connection, e.g. to run against a stand-in broker. By
+        default a `pika.BlockingConnection` to `addr` is opened.
+    content_type : Optional[str]
+        Content type set in the properties of every message.
+
+    """
+
+    def __init__(self, addr, exchange, routing_key='', batch_size=64, flush_interval=0.1, confirm=False,
+                 buffer_size=10000, drop_policy=DROP_OLDEST, reconnect_interval=1., connection_factory=None,
+                 content_type=None):
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f'undefined drop policy {drop_policy}')
+
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.confirm = confirm
+        self.buffer_size = buffer_size
+        self.drop_policy = drop_policy
+        self.reconnect_interval = reconnect_interval
+        self.properties = None if content_type is None else pika.BasicProperties(content_type=content_type)
+
+        if connection_factory is None:
+            def connection_factory():
+                return pika.BlockingConnection(pika.URLParameters(addr))
+        self.connection_factory = connection_factory
+        self.connection = None
+        self.channel = None
+
+        self.buffer = deque()
+        self.condition = Condition()
+        self.running = True
+
+        self.published = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.connections = 0
+        self.start_time = time.time()
+
+        self.thread = Thread(target=self.run, name='rabbitmq-publisher')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def publish(self, body):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+
+        with self.condition:
+            if len(self.buffer) >= self.buffer_size:
+                self.dropped += 1
+                if self.drop_policy == DROP_NEWEST:
+                    return
+                self.buffer.popleft()
+            self.buffer.append(body)
+            if len(self.buffer) >= self.batch_size:
+                self.condition.notify()
+
+    def stop(self, timeout=5.):
+        """Send the pending messages and close the connection."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
+
+    def get_stats(self):
+        with self.condition:
+            elapsed = time.time() - self.start_time
+            return {'published': self.published, 'dropped': self.dropped, 'failed': self.failed,
+                    'pending': len(self.buffer), 'batches': self.batches, 'connections': self.connections,
+                    'messages_per_second': self.published / elapsed if elapsed > 0 else 0.}
+
+    def run(self):
+        while True:
+            with self.condition:
+                deadline = time.time() + self.flush_interval
+                while self.running and len(self.buffer) < self.batch_size:
+                    timeout = deadline - time.time()
+                    if timeout <= 0:
+                        break
+                    self.condition.wait(timeout)
+
+                if not self.running and len(self.buffer) == 0:
+                    break
+                batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+
+            if len(batch) == 0:
+                self._process_events()
+                continue
+
+            sent = self._send(batch)
+            if sent < len(batch):
+                # the published part of the batch must not be sent twice
+                self._requeue(batch[sent:])
+                if not self.running:
+                    break
+                with self.condition:
+                    self.condition.wait(self.reconnect_interval)
+
+        self._close()
+
+    def _send(self, batch):
+        """Publish a batch, returns the number of messages published before a failure."""
+        sent = 0
+        try:
+            if self.channel is None or not self.channel.is_open:
+                self._connect()
+
+            for body in batch:
+                self.channel.basic_publish(exchange=self.exchange, routing_key=self.routing_key, body=body,
+                                           properties=self.properties)
+                sent += 1
+        except Exception as e:
+            logging.error(f'rabbitmq publisher: {e}')
+            with self.condition:
+                self.published += sent
+                self.failed += 1
+            self._close()
+            return sent
+
+        with self.condition:
+            self.published += sent
+            self.batches += 1
+        return sent
+
+    def _process_events(self):
+        """Service an idle connection, e.g. answer heartbeats of the broker."""
+        if self.connection is None or not self.connection.is_open:
+            return
+        try:
+            self.connection.process_data_events(0)
+        except Exception as e:
+            logging.error(f'rabbitmq publisher: {e}')
+            self._close()
+
+    def _requeue(self, batch):
+        with self.condition:
+            self.buffer.extendleft(reversed(batch))
+            while len(self.buffer) > self.buffer_size:
+                self.dropped += 1
+                if self.drop_policy == DROP_NEWEST:
+                    self.buffer.pop()
+                else:
+                    self.buffer.popleft()
+
+    def _connect(self):
+        self._close()
+        self.connection = self.connection_factory()
+        self.channel = self.connection.channel()
+        if self.confirm:
+            self.channel.confirm_delivery()
+        self.connections += 1
+
+    def _close(self):
+        try:
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except Exception as e:
+            logging.error(f'rabbitmq publisher: {e}')
+        self.connection = None
+        self.channel = None
@@ -0,0 +1,226 @@
+import asyncio
+import os
+import time
+from threading import Lock, Event
+from urllib.parse import urlsplit, urlunsplit
+from api.model.frame_buffer import FrameBuffer, LATEST
+
+DEFAULT_PORTS = {'http': 80, 'https': 443, 'rtsp': 554, 'rtmp': 1935}
+
+
+def normalize_source_address(addr, type='video'):
+    """Key of a physical source, the same for addresses that differ only in spelling."""
+    addr = addr.strip()
+    if type == 'youtube':
+        return f'youtube:{addr}'
+    if addr.isdigit():
+        return f'device:{int(addr)}'
+
+    parts = urlsplit(addr)
+    if not parts.scheme or not parts.netloc:
+        return os.path.normpath(addr)
+
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname.lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{parts.port}'
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f'{parts.username}:{parts.password}'
+        netloc = f'{userinfo}@{netloc}'
+    return urlunsplit((scheme, netloc, parts.path or '/', parts.query, ''))
+
+
+class Subscription:
+    """
+    A viewer of a shared source. Frames are handed over through a slot that
+    holds only the newest frame, so a slow viewer skips frames instead of
+    stalling the source or the other viewers.
+    """
+
+    def __init__(self, source, user_id=None, process_id=None):
+        self.source = source
+        self.user_id = user_id
+        self.process_id = process_id
+
+        self.slot = FrameBuffer(size=1, policy=LATEST, max_frame_age=None)
+        self.closed = False
+        self.last_active_time = time.time()
+
+        # set from the thread putting a frame when the subscription is read on an event loop
+        self.loop = None
+        self.ready = None
+
+    def attach_loop(self, loop):
+        """Wake up `get_async` on `loop` whenever a frame is put. Must be called on the loop."""
+        self.ready = asyncio.Event()
+        self.loop = loop
+
+    def put(self, frame):
+        self.slot.put(frame)
+        if self.loop is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.ready.set)
+            except RuntimeError:
+                # the loop is already closed
+                self.loop = None
+
+    def get(self, timeout=None):
+        """Return the newest frame that was not read yet or None on timeout."""
+        entry = self.slot.get(timeout)
+        self.last_active_time = time.time()
+        return None if entry is None else entry[2]
+
+    async def get_async(self, timeout=None):
+        """Like `get`, but waits on the event loop passed to `attach_loop` instead of blocking a thread."""
+        while True:
+            self.ready.clear()
+            if self.slot.seq > self.slot.last_read_seq:
+                return self.get(timeout=0)
+
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.last_active_time = time.time()
+                return None
+
+    def is_closed(self):
+        return self.closed or self.source.is_closed()
+
+    def get_stats(self):
+        return {'userId': self.user_id, 'processId': self.process_id,
+                'idle': time.time() - self.last_active_time, **self.slot.get_stats()}
+
+
+class SharedSource:
+    """
+    The processing session of one physical source and the subscriptions it
+    fans out to. `open_event` is set once the session is opened or opening it
+    failed with `error`.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.session = None
+        self.subscriptions = []
+        self.lock = Lock()
+
+        self.open_event = Event()
+        self.error = None
+
+    def is_closed(self):
+        if not self.open_event.is_set():
+            return False
+        return self.error is not None or self.session.is_closed()
+
+    def get_subscriptions(self):
+        with self.lock:
+            return list(self.subscriptions)
+
+    def broadcast(self, frame):
+        """Put a frame into the slot of every subscription, returns the number of subscriptions."""
+        subscriptions = self.get_subscriptions()
+        for subscription in subscriptions:
+            subscription.put(frame)
+        return len(subscriptions)
+
+    def get_stats(self):
+        return {'source': self.key, 'subscribers': [subscription.get_stats()
+                                                    for subscription in self.get_subscriptions()]}
+
+
+class SourceRegistry:
+    """
+    Runs one processing session per physical source, keyed by its normalized
+    address, and fans its frames out to every subscription of the source.
+
+    A source without a running session is opened with `open_session(source)`
+    on the first subscription and closed with `close_session(session)` once
+    its last subscription is removed or expired. Opening a source, e.g.
+    connecting to a camera, happens outside of the registry lock: the source
+    is registered first and further subscribers of it wait until it is open,
+    while other sources are not held up. A source whose session was closed
+    otherwise, e.g. by the idle reaper, is opened again on the next
+    subscription.
+    """
+
+    def __init__(self, close_session):
+        self.close_session = close_session
+        self.sources = {}
+        self.lock = Lock()
+
+        self.opened = 0
+        self.shared = 0
+
+    def subscribe(self, key, open_session, user_id=None, process_id=None):
+        with self.lock:
+            source = self.sources.get(key)
+            opening = source is None or source.is_closed()
+            if opening:
+                source = SharedSource(key)
+                self.sources[key] = source
+                self.opened += 1
+            else:
+                self.shared += 1
+
+            subscription = Subscription(source, user_id, process_id)
+            with source.lock:
+                source.subscriptions.append(subscription)
+
+        if opening:
+            try:
+                source.session = open_session(source)
+            except Exception as e:
+                source.error = e
+                with self.lock:
+                    if self.sources.get(key) is source:
+                        del self.sources[key]
+                raise
+            finally:
+                source.open_event.set()
+        else:
+            source.open_event.wait()
+            if source.error is not None:
+                raise Exception(f'source {key} could not be opened: {source.error}')
+        return subscription
+
+    def unsubscribe(self, subscription):
+        source = subscription.source
+        with self.lock:
+            with source.lock:
+                subscription.closed = True
+                if subscription not in source.subscriptions:
+                    return
+                source.subscriptions.remove(subscription)
+                last = len(source.subscriptions) == 0
+
+            if last and self.sources.get(source.key) is source:
+                del self.sources[source.key]
+
+        if last:
+            self.close_session(source.session)
+
+    def expire(self, source, idle_timeout):
+        """Remove subscriptions that did not read for `idle_timeout` seconds, e.g. of a client that stopped reading.
+
+        The session of the source is closed if no subscription is left.
+        """
+        current_time = time.time()
+        with self.lock:
+            with source.lock:
+                expired = [subscription for subscription in source.subscriptions
+                           if current_time - subscription.last_active_time > idle_timeout]
+                for subscription in expired:
+                    subscription.closed = True
+                    source.subscriptions.remove(subscription)
+                last = len(expired) > 0 and len(source.subscriptions) == 0
+
+            if last and self.sources.get(source.key) is source:
+                del self.sources[source.key]
+
+        if last:
+            self.close_session(source.session)
+        return expired
+
+    def get_stats(self):
+        with self.lock:
+            return {'sources': len(self.sources), 'opened': self.opened, 'shared': self.shared}
@@ -0,0 +1,136 @@
+import itertools
+import logging
+import time
+from threading import Thread, Event, Lock, active_count, current_thread
+
+
+class StreamSession:
+    """
+    Owns the resources of one stream: the camera pipeline, worker threads
+    and anything else registered with `add_resource`. Workers get the session
+    as their first argument and have to return once `stop_event` is set.
+    """
+
+    def __init__(self, session_id, camera, user_id=None, process_id=None):
+        self.session_id = session_id
+        self.camera = camera
+        self.user_id = user_id
+        self.process_id = process_id
+
+        self.stop_event = Event()
+        self.workers = []
+        self.resources = []
+        self.stats = {}
+
+        self.created_time = time.time()
+        self.last_active_time = self.created_time
+        self.frames = 0
+
+    def start_worker(self, name, target, *args):
+        thread = Thread(target=target, args=(self,) + args, name=f'{name}-{self.session_id}')
+        thread.daemon = True
+        self.workers.append(thread)
+        thread.start()
+        return thread
+
+    def add_resource(self, resource):
+        """Register an object whose `close` is called when the session is closed."""
+        self.resources.append(resource)
+        return resource
+
+    def add_stats(self, name, source):
+        """Register an object whose `get_stats` is reported with the session."""
+        self.stats[name] = source
+        return source
+
+    def touch(self):
+        self.frames += 1
+        self.last_active_time = time.time()
+
+    def is_closed(self):
+        return self.stop_event.is_set()
+
+    def close(self, timeout=1.):
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+
+        self.camera.close()
+        for worker in self.workers:
+            # a worker may close its own session
+            if worker is not current_thread():
+                worker.join(timeout)
+        for resource in self.resources:
+            try:
+                resource.close()
+            except Exception as e:
+                logging.error(f'session {self.session_id}: {e}')
+
+    def get_stats(self):
+        current_time = time.time()
+        return {'id': self.session_id, 'userId': self.user_id, 'processId': self.process_id,
+                'frames': self.frames, 'age': current_time - self.created_time,
+                'idle': current_time - self.last_active_time,
+                'workers': sum(worker.is_alive() for worker in self.workers),
+                'capture': self.camera.threaded_camera.get_stats(),
+                **{name: source.get_stats() for name, source in self.stats.items()}}
+
+
+class SessionManager:
+    """
+    Keeps track of all open stream sessions and closes sessions that did not
+    deliver a frame for `idle_timeout` seconds, e.g. because the client
+    stopped reading without closing the connection.
+    """
+
+    def __init__(self, idle_timeout=30., check_interval=1.):
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+
+        self.sessions = {}
+        self.lock = Lock()
+        self.ids = itertools.count(1)
+
+        self.opened = 0
+        self.closed = 0
+        self.expired = 0
+
+        self.thread = Thread(target=self.run, name='session-reaper')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def open(self, camera, user_id=None, process_id=None):
+        with self.lock:
+            session = StreamSession(next(self.ids), camera, user_id, process_id)
+            self.sessions[session.session_id] = session
+            self.opened += 1
+            return session
+
+    def close(self, session):
+        with self.lock:
+            if self.sessions.pop(session.session_id, None) is None:
+                return
+            self.closed += 1
+        session.close()
+
+    def run(self):
+        while True:
+            time.sleep(self.check_interval)
+            current_time = time.time()
+            with self.lock:
+                expired = [session for session in self.sessions.values()
+                           if current_time - session.last_active_time > self.idle_timeout]
+                self.expired += len(expired)
+
+            for session in expired:
+                logging.info(f'session {session.session_id} is idle for {self.idle_timeout} s, closing')
+                self.close(session)
+
+    def get_stats(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            stats = {'sessions': len(sessions), 'opened': self.opened, 'closed': self.closed,
+                     'expired': self.expired}
+        stats['threads'] = active_count()
+        stats['streams'] = [session.get_stats() for session in sessions]
+        return stats
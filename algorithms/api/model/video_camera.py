@@ -1,21 +1,30 @@
 import cv2
+import copy
 import numpy as np
 import time
 import streamlink
 from threading import Thread
+from api.model.pipeline import FramePipeline
+from api.model.frame_buffer import FrameBuffer
+import config
 
 
 class ThreadedCamera:
-    def __init__(self, src):
+    def __init__(self, src, policy=config.capture_policy, every_nth=config.capture_every_nth,
+                 max_frame_age=config.capture_max_frame_age, buffer_size=config.capture_buffer_size):
         self.capture = cv2.VideoCapture(src)
-        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 100)
+        # frames are buffered in our own ring, the backend should hand out the freshest one
+        self.capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
-        # FPS = 1/X
-        # X = desired FPS
-        self.FPS = 1 / 60
-        self.FPS_MS = int(self.FPS * 1000)
+        self.buffer = FrameBuffer(size=buffer_size, policy=policy, every_nth=every_nth, max_frame_age=max_frame_age)
+        self.retry_interval = 0.01
+        self.running = True
 
-        self.status, self.frame = None, None
+        # a file is decoded as fast as possible, so it is paced at its frame rate like a live source
+        self.frame_interval = None
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        if self.capture.get(cv2.CAP_PROP_FRAME_COUNT) > 0 and fps > 0:
+            self.frame_interval = 1. / fps
 
         # Start frame retrieval thread
         self.thread = Thread(target=self.update, args=())
@@ -23,57 +32,106 @@ class ThreadedCamera:
         self.thread.start()
 
     def update(self):
-        while True:
-            if self.capture.isOpened():
-                self.status, self.frame = self.capture.read()
-            time.sleep(self.FPS)
+        next_time = time.time()
+        while self.running:
+            status, frame = self.capture.read() if self.capture.isOpened() else (False, None)
+            if status:
+                self.buffer.put(frame)
+                if self.frame_interval is not None:
+                    # do not catch up after a stall, continue at the frame rate from now on
+                    next_time = max(next_time + self.frame_interval, time.time() - self.frame_interval)
+                    time.sleep(max(next_time - time.time(), 0))
+            else:
+                time.sleep(self.retry_interval)
+        self.capture.release()
 
-    def get_frame(self):
-        frame = self.frame
-        cv2.waitKey(self.FPS_MS)
-        return frame
+    def read(self, timeout=1.):
+        return self.buffer.get(timeout=timeout)
 
+    def get_frame(self, timeout=1.):
+        entry = self.read(timeout)
+        return None if entry is None else entry[2]
 
-class YoutubeCamera:
-    def __init__(self, model, video_id):
-        self.model = model
-        url = f'https://www.youtube.com/watch?v={video_id}'
+    def get_stats(self):
+        return self.buffer.get_stats()
 
-        streams = streamlink.streams(url)
-        self.threaded_camera = ThreadedCamera(streams["720p"].url)
-
-    def get_frame(self):
-        img = None
-        while img is None:
-            img = self.threaded_camera.get_frame()
-        img = np.array(img)
-        t1 = time.time()
-        img, det_info = self.model.detect_image(img)
-        t2 = time.time()
-        fps = "FPS: " + str(int(1000 // int(1000 * (t2 - t1))))
-        cv2.putText(img, text=fps, org=(3, 15), fontFace=cv2.FONT_HERSHEY_SIMPLEX,
-                    fontScale=0.50, color=(255, 0, 0), thickness=2)
-        img = np.asarray(img)
-        ret, img = cv2.imencode('.jpg', img)
-        return img.tobytes(), det_info
+    def stop(self):
+        self.running = False
 
 
 class VideoCamera:
-    def __init__(self, model, src):
+    """
+    Runs capture -> detect -> track -> draw -> encode as a pipeline of worker
+    threads connected by bounded queues, so that CPU stages of one frame
+    overlap with inference of the next one. A frame is read and preprocessed
+    in one step only when the detector is about to take it, so with the
+    `latest` policy it is the newest frame at the time detection starts.
+    """
+
+    def __init__(self, model, src, queue_size=1):
         self.model = model
+        # tracking state of this stream, the model weights are shared with other streams
+        self.context = model.create_context() if model.use_tracking else None
         self.threaded_camera = ThreadedCamera(src)
 
-    def get_frame(self):
-        img = None
-        while img is None:
-            img = self.threaded_camera.get_frame()
-        img = np.array(img)
-        t1 = time.time()
-        img, det_info = self.model.detect_image(img)
-        t2 = time.time()
-        fps = "FPS: " + str(int(1000 // int(1000 * (t2 - t1))))
-        cv2.putText(img, text=fps, org=(3, 15), fontFace=cv2.FONT_HERSHEY_SIMPLEX,
+        self.prev_time = None
+        self.fps = 0.
+
+        self.pipeline = FramePipeline(self.capture, [('detect', self.detect),
+                                                     ('track', self.track),
+                                                     ('draw', self.draw),
+                                                     ('encode', self.encode)], queue_size=queue_size)
+
+    def capture(self):
+        entry = self.threaded_camera.read()
+        if entry is None:
+            return None
+        seq, timestamp, frame = entry
+        frame = np.array(frame)
+        return {'seq': seq, 'timestamp': timestamp, 'frame': frame, 'input': self.model.preprocess(frame)}
+
+    def detect(self, item):
+        # a stalled detector may still leave the prefetched frame waiting too long, it is never detected stale
+        if not self.threaded_camera.buffer.check_age(item['timestamp']):
+            return None
+        item['outputs'] = self.model.detect(item['input'])
+        return item
+
+    def track(self, item):
+        item['tracks'] = None
+        if self.model.use_tracking:
+            # the tracker keeps updating its tracks while this frame is drawn, so pass on a snapshot
+            tracks = self.model.track(item['frame'], item['outputs'], self.context)
+            item['tracks'] = [copy.copy(track) for track in tracks]
+        return item
+
+    def draw(self, item):
+        item['image'], item['det_info'] = self.model.draw(item['frame'], item['outputs'], item['tracks'])
+        return item
+
+    def encode(self, item):
+        current_time = time.time()
+        if self.prev_time is not None and current_time > self.prev_time:
+            self.fps = 0.9 * self.fps + 0.1 / (current_time - self.prev_time)
+        self.prev_time = current_time
+
+        img = np.asarray(item['image'])
+        cv2.putText(img, text=f'FPS: {int(self.fps)}', org=(3, 15), fontFace=cv2.FONT_HERSHEY_SIMPLEX,
                     fontScale=0.50, color=(255, 0, 0), thickness=2)
-        img = np.asarray(img)
         ret, img = cv2.imencode('.jpg', img)
-        return img.tobytes(), det_info
+        return img.tobytes(), item['det_info']
+
+    def get_frame(self, timeout=None):
+        return self.pipeline.get(timeout=timeout)
+
+    def close(self):
+        self.pipeline.stop()
+        self.threaded_camera.stop()
+
+
+class YoutubeCamera(VideoCamera):
+    def __init__(self, model, video_id, queue_size=1):
+        url = f'https://www.youtube.com/watch?v={video_id}'
+
+        streams = streamlink.streams(url)
+        super().__init__(model, streams["720p"].url, queue_size=queue_size)
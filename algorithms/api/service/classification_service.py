@@ -1,21 +1,42 @@
 from libs.capsnets.utils import VideoClassCapsNetModel
+from libs.batching import DynamicBatcher
 from datetime import datetime
 import json
+import config
 
 video_model = VideoClassCapsNetModel()
 
+# clips of concurrent requests are classified together
+classification_batcher = None
+if config.classification_max_batch_size > 1:
+    classification_batcher = DynamicBatcher(video_model.predict_batch,
+                                            max_batch_size=config.classification_max_batch_size,
+                                            max_latency=config.classification_max_latency,
+                                            name='classification-batcher')
+
+
+def clips_classification(clips):
+    # a malformed clip fails its own request here instead of the batch it would be merged into
+    for clip in clips:
+        video_model.check_clip(clip)
+
+    if classification_batcher is not None:
+        futures = [classification_batcher.submit(clip) for clip in clips]
+        outputs = [future.result() for future in futures]
+    else:
+        outputs = video_model.predict_batch(clips)
 
-def videos_classification(npzfile):
     result = dict()
-    i = 0
-    for key in npzfile.files:
-        class_name, confidence = video_model.predict_short(npzfile[key])
+    for i, (class_name, confidence) in enumerate(outputs):
         result[i] = json.dumps(
             {
                 "datetime": str(datetime.now()),
                 "class": class_name,
                 "confidence": confidence.astype(float)
             })
-        i += 1
 
     return result
+
+
+def videos_classification(npzfile):
+    return clips_classification([npzfile[key] for key in npzfile.files])
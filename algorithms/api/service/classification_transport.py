@@ -0,0 +1,126 @@
+import io
+import json
+import numpy as np
+import requests
+import config
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # shared memory blocks are available from python 3.8
+    shared_memory = None
+
+IN_PROCESS = 'in_process'
+SHARED_MEMORY = 'shm'
+RAW = 'raw'
+NPZ = 'npz'
+
+
+class InProcessTransport:
+    """Classifies clips with a video model loaded into the current process."""
+
+    def __init__(self):
+        from api.service.classification_service import clips_classification
+        self.clips_classification = clips_classification
+
+    def classify(self, clips):
+        return self.clips_classification(clips)
+
+    def close(self):
+        pass
+
+
+class RawHttpTransport:
+    """Posts uncompressed uint8 clips, the shape travels in a header."""
+
+    def __init__(self, addr=config.video_classification_addr):
+        self.addr = f'{addr}/raw'
+        self.session = requests.Session()
+
+    def classify(self, clips):
+        clips = np.ascontiguousarray(clips, dtype=np.uint8)
+        r = self.session.post(self.addr, data=clips.tobytes(),
+                              headers={'Content-Type': 'application/octet-stream',
+                                       'X-Clip-Shape': ','.join(str(dim) for dim in clips.shape)})
+        return json.loads(r.text)
+
+    def close(self):
+        self.session.close()
+
+
+class SharedMemoryTransport:
+    """
+    Copies clips into a shared memory slab and posts only its name and the
+    clip shape, the classification server has to run on the same host. The
+    slab is reused between requests and grown when a batch does not fit.
+    """
+
+    def __init__(self, addr=config.video_classification_addr, size=16 * 8 * 112 * 112 * 3):
+        if shared_memory is None:
+            raise Exception('shared memory transport requires python 3.8 or newer')
+
+        self.addr = f'{addr}/shm'
+        self.session = requests.Session()
+        self.slab = shared_memory.SharedMemory(create=True, size=size)
+
+    def classify(self, clips):
+        clips = np.asarray(clips, dtype=np.uint8)
+        if clips.nbytes > self.slab.size:
+            self._release()
+            self.slab = shared_memory.SharedMemory(create=True, size=2 * clips.nbytes)
+
+        np.ndarray(clips.shape, np.uint8, buffer=self.slab.buf)[:] = clips
+        r = self.session.post(self.addr, json={'name': self.slab.name, 'shape': list(clips.shape)})
+        return json.loads(r.text)
+
+    def close(self):
+        self._release()
+        self.session.close()
+
+    def _release(self):
+        self.slab.close()
+        self.slab.unlink()
+
+
+class NpzHttpTransport:
+    """Posts clips as a compressed npz file, the original wire format."""
+
+    def __init__(self, addr=config.video_classification_addr):
+        self.addr = addr
+        self.session = requests.Session()
+
+    def classify(self, clips):
+        buf = io.BytesIO()
+        np.savez_compressed(buf, *clips)
+        buf.seek(0)
+
+        r = self.session.post(self.addr, files={'file': buf})
+        return json.loads(r.text)
+
+    def close(self):
+        self.session.close()
+
+
+def create_transport(transport=config.video_classification_transport, addr=config.video_classification_addr):
+    if transport == IN_PROCESS:
+        return InProcessTransport()
+    elif transport == SHARED_MEMORY:
+        return SharedMemoryTransport(addr)
+    elif transport == RAW:
+        return RawHttpTransport(addr)
+    elif transport == NPZ:
+        return NpzHttpTransport(addr)
+    else:
+        raise Exception(f'undefined video classification transport {transport}')
+
+
+def read_shared_clips(name, shape):
+    """Copy clips out of a shared memory slab created by `SharedMemoryTransport`."""
+    if shared_memory is None:
+        raise Exception('shared memory transport requires python 3.8 or newer')
+
+    slab = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(tuple(shape), np.uint8, buffer=slab.buf).copy()
+    finally:
+        slab.close()
@@ -1,17 +1,18 @@
 from flask import Response
 import logging
 from api.model.video_camera import YoutubeCamera, VideoCamera
+from api.model.clip_store import ClipStore
+from api.model.rabbitmq_publisher import RabbitMQPublisher
+from api.model.stream_session import SessionManager
+from api.model.source_registry import SourceRegistry, normalize_source_address
+from api.model.detection_events import create_event_encoder, ImagePolicy, ByteRateCounter
+from api.model.event_emitter import EventEmitter, TRACK_ENDED
+from api.service.classification_transport import create_transport
 import config
 from libs.detection.utils import ObjectDetectionModel
 import cv2
-import numpy as np
-import base64
-import pika
 import json
-from multiprocessing import Queue
-from threading import Thread
-import io
-import requests
+from queue import Queue, Empty
 
 # logging.basicConfig()
 # logging.root.setLevel(logging.NOTSET)
@@ -19,98 +20,109 @@ import requests
 STAT_FANOUT_QUEUE_NAME = "stat.fanout.queue"
 STAT_EXCHANGE_NAME = "stat.fanout.exchange"
 
-tracking_model = ObjectDetectionModel(model='yolo3', classes=[clazz.split('\n')[0] for clazz in open(config.coco_classes_ru)], use_tracking=True)
+# blocking gets wake up this often to notice a closed session
+QUEUE_TIMEOUT = 0.5
 
+CLIP_LENGTH = 8
+# the classifier resizes a 320x240 person crop to 120x160 and takes the central 112x112,
+# so the crop is cut to that region and resized once straight to the classifier input
+CLIP_FRAME_SIZE = (112, 112)
+CLIP_FRAME_REGION = (4 / 120, 24 / 160, 116 / 120, 136 / 160)
 
-def rabbitmq_thread(rabbitmq_queue):
-    while True:
-        if not rabbitmq_queue.empty():
-            value = rabbitmq_queue.get()
-            try:
-                rmq_parameters = pika.URLParameters(config.rabbitmq_addr)
-                rmq_connection = pika.BlockingConnection(rmq_parameters)
-                rmq_channel = rmq_connection.channel()
+tracking_model = ObjectDetectionModel(model='yolo3', classes=[clazz.split('\n')[0] for clazz in open(config.coco_classes_ru)], use_tracking=True,
+                                      max_batch_size=config.detection_max_batch_size,
+                                      max_latency=config.detection_max_latency,
+                                      feature_cache=config.reid_cache,
+                                      feature_cache_iou_threshold=config.reid_cache_iou_threshold,
+                                      feature_cache_max_reuse=config.reid_cache_max_reuse)
 
-                rmq_channel.basic_publish(exchange=STAT_EXCHANGE_NAME,
-                                          routing_key=STAT_FANOUT_QUEUE_NAME,
-                                          body=value.encode('utf-8'))
+event_encoder = create_event_encoder(config.event_format)
 
-                rmq_connection.close()
-            except Exception as e:
-                logging.error(e)
+stat_publisher = RabbitMQPublisher(config.rabbitmq_addr, STAT_EXCHANGE_NAME, STAT_FANOUT_QUEUE_NAME,
+                                   batch_size=config.rabbitmq_batch_size,
+                                   flush_interval=config.rabbitmq_flush_interval,
+                                   confirm=config.rabbitmq_confirm,
+                                   buffer_size=config.rabbitmq_buffer_size,
+                                   drop_policy=config.rabbitmq_drop_policy,
+                                   content_type=event_encoder.content_type)
 
+session_manager = SessionManager(idle_timeout=config.session_idle_timeout)
+source_registry = SourceRegistry(close_session=session_manager.close)
+
+
+def video_classification_thread(session, transport, queue_input, queue_output):
+    while not session.is_closed():
+        try:
+            clip_store = queue_input.get(timeout=QUEUE_TIMEOUT)
+        except Empty:
+            continue
 
-def video_classification_thread(queue_input, queue_output):
-    while True:
         try:
-            if not queue_input.empty():
-                objects = queue_input.get()
-                videos = []
-                keys = []
-                for key in objects.keys():
-                    frames = objects[key]
-                    if len(frames) == 8:
-                        video = np.stack(frames, axis=0)
-                        videos.append(video)
-                        keys.append(key)
-
-                if len(videos) > 0 and len(keys) > 0:
-                    buf = io.BytesIO()
-                    np.savez_compressed(buf, *videos)
-                    buf.seek(0)
-
-                    r = requests.post(config.video_classification_addr, files={'file': buf})
-                    j = json.loads(r.text)
-                    outputs = dict()
-                    for key, data in j.items():
-                        outputs[keys[int(key)]] = data
-                        queue_output.put(outputs)
+            keys, videos = clip_store.get_clips()
+
+            if len(keys) > 0:
+                j = transport.classify(videos)
+                outputs = dict()
+                for key, data in j.items():
+                    outputs[keys[int(key)]] = data
+                    queue_output.put(outputs)
         except Exception as e:
             logging.error(e)
 
 
-def get_video_frame_with_tracking(cam, user_id, process_id):
+def process_source(session, source):
+    """Track, classify and publish the events of one source, hands the frames to its subscriptions."""
     i = 1
+    cam = session.camera
 
-    objects_frames = dict()
+    clip_store = ClipStore(clip_length=CLIP_LENGTH, frame_shape=CLIP_FRAME_SIZE + (3,))
     objects_events = dict()
-
-    rabbitmq_queue = Queue()
-    rabbitmq_process = Thread(target=rabbitmq_thread, args=(rabbitmq_queue,))
-    rabbitmq_process.start()
+    image_policy = ImagePolicy(config.event_image_policy)
+    event_bytes = session.add_stats('events', ByteRateCounter())
+    emitter = session.add_stats('emitter', EventEmitter(config.event_emission, config.event_update_interval,
+                                                        config.event_min_displacement))
+
+    def publish_event(event_type, attributes):
+        # every viewer of the source gets the events under its own user and process
+        for subscription in subscriptions:
+            body = event_encoder.encode({'type': event_type,
+                                         'attributes': dict(attributes, userId=subscription.user_id,
+                                                            processId=subscription.process_id)})
+            stat_publisher.publish(body)
+            event_bytes.add(len(body), attributes['image'] is not None)
 
     video_classification_input_queue = Queue()
     video_classification_output_queue = Queue()
 
-    video_classification_process = Thread(target=video_classification_thread, args=(video_classification_input_queue,
-                                                                                    video_classification_output_queue))
-    video_classification_process.start()
+    transport = session.add_resource(create_transport(config.video_classification_transport))
+    session.start_worker('video-classification', video_classification_thread, transport,
+                         video_classification_input_queue, video_classification_output_queue)
 
-    while True:
-        frame, det_info = cam.get_frame()
-
-        for obj in det_info:
-            if obj.get_class() == 'person':
-                imgdata = base64.b64decode(obj.get_img())
-                decoded = np.frombuffer(imgdata, np.uint8)
-                decoded = cv2.imdecode(decoded, cv2.IMREAD_COLOR)
+    while not session.is_closed():
+        try:
+            frame, det_info = cam.get_frame(timeout=QUEUE_TIMEOUT)
+        except Empty:
+            continue
 
-                gray = cv2.cvtColor(decoded, cv2.COLOR_BGR2GRAY)
-                _, thresh = cv2.threshold(gray, 1, 255, cv2.THRESH_BINARY)
-                contours, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                cnt = contours[0]
-                x, y, w, h = cv2.boundingRect(cnt)
-                decoded = decoded[y:y + h, x:x + w]
+        source_registry.expire(source, config.session_idle_timeout)
+        subscriptions = source.get_subscriptions()
 
-                decoded = cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB)
-                decoded = cv2.resize(decoded, (240, 320))
+        # clips of tracks deleted by the tracker are never completed
+        live_track_ids = [track.track_id for track in cam.context.tracker.tracks]
+        clip_store.evict(live_track_ids)
+        image_policy.evict(live_track_ids)
+        for _, attributes in emitter.end(live_track_ids):
+            publish_event(TRACK_ENDED, dict(attributes, iteration=i, image=None, eventClass=None,
+                                            eventTime=None, eventAccuracy=None))
 
-                frames = objects_frames.get(obj.get_num(), [])
-                frames.append(decoded)
-                objects_frames[obj.get_num()] = frames
+        for obj in det_info:
+            if obj.get_class() == 'person':
+                decoded = obj.get_crop(CLIP_FRAME_SIZE, CLIP_FRAME_REGION)
+                if decoded is not None:
+                    clip_store.append(obj.get_num(), cv2.cvtColor(decoded, cv2.COLOR_BGR2RGB))
 
                 if video_classification_input_queue.empty():
-                    video_classification_input_queue.put(objects_frames)
+                    video_classification_input_queue.put(clip_store)
 
                 if not video_classification_output_queue.empty():
                     objects_events = video_classification_output_queue.get()
@@ -125,43 +137,86 @@ def get_video_frame_with_tracking(cam, user_id, process_id):
                 else:
                     event_class = event_time = event_accuracy = None
 
-                json_str = {
-                    'type': 'OBJECT_DETECTION',
-                    'attributes':
-                        {
-                            'userId': user_id, 'processId': process_id,
-                            'class': obj.get_class(), 'box': obj.get_box(),
-                            'score': obj.get_score(), 'numObject': obj.get_num(),
-                            'iteration': i, 'image': obj.get_img(),
-                            'eventClass': event_class,
-                            'eventTime': event_time,
-                            'eventAccuracy': event_accuracy
-                        }
+                attributes = {
+                    'class': obj.get_class(), 'box': obj.get_box(),
+                    'score': obj.get_score(), 'numObject': obj.get_num(),
+                    'iteration': i, 'image': None,
+                    'eventClass': event_class,
+                    'eventTime': event_time,
+                    'eventAccuracy': event_accuracy
                 }
 
-                if event is not None and len(objects_frames[obj.get_num()]) > 8:
+                if event is not None:
                     logging.info(f'{event_time} {event_class} {event_accuracy}')
-                    objects_frames[obj.get_num()] = []
+                    clip_store.reset(obj.get_num())
                     objects_events[obj.get_num()] = None
 
-                json_dumps = json.dumps(json_str)
-                rabbitmq_queue.put(json_dumps)
+                # a new crop is worth a message of its own
+                attach_image = image_policy.should_attach(obj.get_num(), obj.get_score(), obj.get_box(), event_class)
+                for event_type in emitter.observe(obj.get_num(), attributes, force_update=attach_image):
+                    if attach_image:
+                        attributes = dict(attributes, image=obj.get_img())
+                        attach_image = False
+                    publish_event(event_type, attributes)
+                    attributes = dict(attributes, image=None)
 
             i += 1
 
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame +
-               b'\r\n\r\n')
+        # the session stays alive only while somebody watches it
+        if source.broadcast(frame) > 0:
+            session.touch()
 
 
-def get_video_with_tracking_objects(video_id, user_id, process_id, type='youtube'):
-    tracking_model.clear_tracker()
+def get_video_frame_with_tracking(subscription):
+    try:
+        while not subscription.is_closed():
+            frame = subscription.get(timeout=QUEUE_TIMEOUT)
+            if frame is None:
+                continue
+
+            yield (b'--frame\r\n'
+                   b'Content-Type: image/jpeg\r\n\r\n' + frame +
+                   b'\r\n\r\n')
+    finally:
+        # the generator is closed when the client disconnects
+        close_tracking_subscription(subscription)
 
-    if type == 'youtube':
-        camera = YoutubeCamera(tracking_model, video_id)
-    elif type == 'video':
-        camera = VideoCamera(tracking_model, video_id)
-    else:
+
+def open_tracking_subscription(video_id, user_id, process_id, type='youtube'):
+    """Subscribe to the tracking session of a source.
+
+    Every source is processed once, no matter how many streams of it are open.
+    """
+    if type not in ('youtube', 'video'):
         raise Exception('error detection objects')
-    return Response(get_video_frame_with_tracking(camera, user_id, process_id),
+
+    def open_session(source):
+        if type == 'youtube':
+            camera = YoutubeCamera(tracking_model, video_id)
+        else:
+            camera = VideoCamera(tracking_model, video_id)
+        session = session_manager.open(camera)
+        session.add_stats('fanout', source)
+        session.add_stats('tracking', camera.context)
+        session.start_worker('processing', process_source, source)
+        return session
+
+    return source_registry.subscribe(normalize_source_address(video_id, type), open_session, user_id, process_id)
+
+
+def close_tracking_subscription(subscription):
+    source_registry.unsubscribe(subscription)
+
+
+def open_video_with_tracking_objects(video_id, user_id, process_id, type='youtube'):
+    """Subscribe to the tracking session of a source, returns the generator of its multipart frames."""
+    return get_video_frame_with_tracking(open_tracking_subscription(video_id, user_id, process_id, type))
+
+
+def get_video_with_tracking_objects(video_id, user_id, process_id, type='youtube'):
+    return Response(open_video_with_tracking_objects(video_id, user_id, process_id, type),
                     mimetype='multipart/x-mixed-replace;boundary=frame')
+
+
+def get_sessions_stats():
+    return dict(session_manager.get_stats(), registry=source_registry.get_stats())
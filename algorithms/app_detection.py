@@ -1,12 +1,21 @@
 from flask_ngrok import run_with_ngrok
 from flask import Flask
+import config
 
 
 if __name__ == '__main__':
-    from api import detection_api
+    if config.server_mode == 'aiohttp':
+        from aiohttp import web
+        from api import detection_async_api
 
-    app = Flask(__name__)
-    app.register_blueprint(detection_api.detection_api)
-    run_with_ngrok(app)
+        app = web.Application()
+        app.add_routes(detection_async_api.detection_async_api)
+        web.run_app(app, port=config.server_port)
+    else:
+        from api import detection_api
 
-    app.run()
+        app = Flask(__name__)
+        app.register_blueprint(detection_api.detection_api)
+        run_with_ngrok(app)
+
+        app.run()
@@ -0,0 +1,102 @@
+import logging
+import time
+from concurrent.futures import Future
+from queue import Queue, Empty
+from threading import Thread, Lock
+
+
+class DynamicBatcher:
+    """
+    Collects items submitted from many threads into dynamic batches and runs
+    `predict_fn` once per batch on a single worker thread.
+
+    A batch is dispatched as soon as it holds `max_batch_size` items or
+    `max_latency` seconds have passed since its first item arrived, whichever
+    comes first. If `predict_fn` fails for a batch, its items are run one by
+    one, so only the submitters of failing items get the exception.
+
+    Parameters
+    ----------
+    predict_fn : Callable[List[object]] -> List[object]
+        Function that takes a list of items and returns a list of results of
+        the same length and order.
+    max_batch_size : int
+        Maximum number of items in one batch.
+    max_latency : float
+        Maximum time in seconds the first item of a batch waits for others.
+
+    """
+
+    def __init__(self, predict_fn, max_batch_size=8, max_latency=0.01, name='dynamic-batcher'):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+
+        self.queue = Queue()
+        self.lock = Lock()
+        self.num_batches = 0
+        self.num_items = 0
+
+        self.thread = Thread(target=self.run, name=name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def get_stats(self):
+        with self.lock:
+            mean_batch_size = self.num_items / self.num_batches if self.num_batches > 0 else 0.
+            return {'batches': self.num_batches, 'items': self.num_items, 'mean_batch_size': mean_batch_size}
+
+    def run(self):
+        while True:
+            request = self.queue.get()
+            if request is None:
+                break
+
+            batch = [request]
+            deadline = time.time() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.queue.get(timeout=timeout)
+                except Empty:
+                    break
+                if request is None:
+                    self.queue.put(None)
+                    break
+                batch.append(request)
+
+            self._process(batch)
+
+    def _process(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            outputs = self.predict_fn(items)
+        except Exception as e:
+            logging.error(e)
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                for request in batch:
+                    self._process([request])
+            return
+
+        with self.lock:
+            self.num_batches += 1
+            self.num_items += len(batch)
+
+        for (_, future), output in zip(batch, outputs):
+            future.set_result(output)
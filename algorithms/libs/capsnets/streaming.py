@@ -0,0 +1,126 @@
+import numpy as np
+import tensorflow as tf
+from collections import deque
+from threading import Lock
+from libs.capsnets.utils import VIDEO_CAPSNET_LAYERS, video_capsnet_tail, preprocess_video
+from libs.inference import compile_inference_function
+
+
+class TrackStream:
+    """Last frames of a track and the activations of the cached layers computed from them."""
+
+    def __init__(self, clip_length, cached_layers):
+        self.frames = deque(maxlen=clip_length)
+        # activations of layer k that are the same for every clip they appear in
+        self.activations = [deque(maxlen=clip_length - 2 * k) for k in range(1, cached_layers + 1)]
+
+
+class StreamingVideoClassifier:
+    """
+    Classifies the last clip of every track each time the track gets a new
+    frame, reusing the computation of the early Conv3D layers between the
+    overlapping clips.
+
+    Every cached layer has a temporal kernel of 3 with zero padding at the
+    clip borders, so at layer k the positions k..clip_length - 1 - k of a
+    clip do not depend on where the clip starts and are the same for every
+    clip containing them. They are computed once per frame from the three
+    newest activations of the layer below. Only the k positions at each clip
+    border are recomputed for every clip. The remaining layers run on the
+    assembled activations of the clip as usual.
+
+    Parameters
+    ----------
+    model : VideoClassCapsNetModel
+        The video classification model.
+    cached_layers : int
+        Number of Conv3D layers computed incrementally. With clips of 8
+        frames at most 3 layers have positions that do not depend on the clip
+        borders. Every layer saves less than the one before and the cache of
+        every track holds clip_length - 2 * k activations of layer k.
+
+    """
+
+    def __init__(self, model, cached_layers=2):
+        self.model = model
+        self.clip_length = model.shape[0]
+        if not 1 <= cached_layers <= (self.clip_length - 1) // 2:
+            raise ValueError(f'{cached_layers} layers can not be cached for clips of {self.clip_length} frames')
+
+        self.cached_layers = cached_layers
+        self.layers = [model.model.get_layer(name) for name in VIDEO_CAPSNET_LAYERS[:cached_layers]]
+        for layer in self.layers:
+            if layer.kernel_size[0] != 3 or layer.strides[0] != 1 or layer.padding != 'same':
+                raise ValueError(f'layer {layer.name} can not be computed incrementally')
+
+        tail = video_capsnet_tail(model.model, VIDEO_CAPSNET_LAYERS[cached_layers], model.num_classes)
+        self.tail_inference = compile_inference_function(tail, tail.input_shape[1:])
+
+        self.streams = {}
+        self.lock = Lock()
+
+    def push(self, track_id, frame):
+        """Add the next uint8 frame of a track.
+
+        Returns the event scores of the last `clip_length` frames of the track or None while it has fewer frames.
+        """
+        x = tf.constant(preprocess_video(frame[np.newaxis], self.model.shape[1:3])[np.newaxis])
+
+        with self.lock:
+            stream = self.streams.get(track_id)
+            if stream is None:
+                stream = TrackStream(self.clip_length, self.cached_layers)
+                self.streams[track_id] = stream
+
+            stream.frames.append(x)
+            below = stream.frames
+            for layer, activations in zip(self.layers, stream.activations):
+                if len(below) < 3:
+                    break
+                activations.append(self._conv(layer, tf.concat(list(below)[-3:], axis=1)))
+                below = activations
+
+            if len(stream.frames) < self.clip_length:
+                return None
+            clip = self._clip_activations(stream)
+
+        return self.tail_inference(clip).numpy()[0]
+
+    def get_class(self, scores):
+        num = int(np.argmax(scores))
+        return self.model.class_names[num], scores[num]
+
+    def reset(self, track_id):
+        with self.lock:
+            self.streams.pop(track_id, None)
+
+    def evict(self, live_track_ids):
+        """Drop the streams of all tracks that are not in `live_track_ids`."""
+        live_track_ids = set(live_track_ids)
+        with self.lock:
+            for track_id in [track_id for track_id in self.streams if track_id not in live_track_ids]:
+                del self.streams[track_id]
+
+    def _clip_activations(self, stream):
+        """Assemble the activations of the last cached layer for the last clip of a stream."""
+        clip = tf.concat(list(stream.frames), axis=1)
+        for k, (layer, activations) in enumerate(zip(self.layers, stream.activations), 1):
+            # the first and last k positions see the zero padding at the clip borders
+            zeros = tf.zeros_like(clip[:, :1])
+            borders = tf.concat([tf.concat([zeros, clip[:, :k + 1]], axis=1),
+                                 tf.concat([clip[:, -k - 1:], zeros], axis=1)], axis=0)
+            borders = self._conv(layer, borders)
+            clip = tf.concat([borders[:1], *activations, borders[1:]], axis=1)
+        return clip
+
+    @staticmethod
+    def _conv(layer, x):
+        """Apply a Conv3D layer to x of shape (N, T, H, W, C) without temporal and with same spatial padding."""
+        pads = [[0, 0], [0, 0]]
+        for size, kernel, stride in zip(x.shape[2:4], layer.kernel_size[1:], layer.strides[1:]):
+            total = max((-(-size // stride) - 1) * stride + kernel - size, 0)
+            pads.append([total // 2, total - total // 2])
+        pads.append([0, 0])
+
+        x = tf.nn.conv3d(tf.pad(x, pads), layer.kernel, strides=(1, 1, *layer.strides[1:], 1), padding='VALID')
+        return layer.activation(tf.nn.bias_add(x, layer.bias))
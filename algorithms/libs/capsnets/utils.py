@@ -4,9 +4,11 @@ from tensorflow.python.ops import array_ops
 from tensorflow.python.ops import math_ops
 from tensorflow.keras.layers import Input, Conv3D
 from libs.capsnets.layers.matrix import PrimaryCapsule3D, ConvolutionalCapsule3D, ClassCapsule
+from libs.inference import compile_inference_function
 import config
 import numpy as np
-from scipy.misc import imresize
+from numpy.lib.stride_tricks import as_strided
+from threading import Lock
 
 
 # v = ((||sj||^2) / (1 + ||sj||^2)) * (sj / ||sj||)
@@ -66,118 +68,180 @@ def own_batch_dot(x, y, axes=None):
     return out
 
 
+def video_capsnet(num_classes, shape=(8, 112, 112, 3)):
+    inputs = Input(shape, name='input')
+    conv1 = Conv3D(filters=64, kernel_size=[3, 3, 3], padding='same', strides=[1, 1, 1],
+                   activation=tf.nn.relu, name='conv1')(inputs)
+    conv2 = Conv3D(filters=128, kernel_size=[3, 3, 3], padding='same', strides=[1, 2, 2],
+                   activation=tf.nn.relu, name='conv2')(conv1)
+    conv3 = Conv3D(filters=256, kernel_size=[3, 3, 3], padding='same', strides=[1, 1, 1],
+                   activation=tf.nn.relu, name='conv3')(conv2)
+    conv4 = Conv3D(filters=256, kernel_size=[3, 3, 3], padding='same', strides=[1, 2, 2],
+                   activation=tf.nn.relu, name='conv4')(conv3)
+    conv5 = Conv3D(filters=512, kernel_size=[3, 3, 3], padding='same', strides=[1, 1, 1],
+                   activation=tf.nn.relu, name='conv5')(conv4)
+    conv6 = Conv3D(filters=512, kernel_size=[3, 3, 3], padding='same', strides=[1, 1, 1],
+                   activation=tf.nn.relu, name='conv6')(conv5)
+    prim_caps = PrimaryCapsule3D(channels=32, kernel_size=[3, 9, 9], strides=[1, 1, 1], padding='valid',
+                                 name='prim_caps')(conv6)
+    sec_caps = ConvolutionalCapsule3D(channels=32, kernel_size=[3, 5, 5], strides=[1, 2, 2], padding='valid',
+                                      route_mean=True, name='sec_caps')(prim_caps)
+    pred_caps = ClassCapsule(n_caps_j=num_classes, subset_routing=-1, route_min=0.0, name='pred_caps',
+                             coord_add=True,
+                             ch_same_w=True)(sec_caps)
+    digit_preds = tf.reshape(pred_caps[1], (-1, num_classes))
+
+    return tf.keras.Model(inputs, digit_preds)
+
+
+VIDEO_CAPSNET_LAYERS = ('conv1', 'conv2', 'conv3', 'conv4', 'conv5', 'conv6', 'prim_caps', 'sec_caps', 'pred_caps')
+
+
+def video_capsnet_tail(model, first_layer, num_classes):
+    """Build the part of a `video_capsnet` model that starts at `first_layer`, sharing its layers and weights."""
+    inputs = Input(model.get_layer(first_layer).input_shape[1:], name='input')
+    x = inputs
+    for name in VIDEO_CAPSNET_LAYERS[VIDEO_CAPSNET_LAYERS.index(first_layer):]:
+        x = model.get_layer(name)(x)
+    digit_preds = tf.reshape(x[1], (-1, num_classes))
+
+    return tf.keras.Model(inputs, digit_preds)
+
+
+def preprocess_video(video, crop_size=(112, 112), out=None):
+    """Resize and crop a uint8 video of shape (frames, height, width, 3) to the network input scaled to [0, 1].
+
+    Videos that are not 112x112 are assumed to have the aspect ratio of (240, 320), all their frames are
+    resized to (120, 160) at once and center cropped. The float32 result is written into `out` if given.
+    """
+    if out is None:
+        out = np.empty((video.shape[0], *crop_size, 3), np.float32)
+
+    if video.shape[1] != 112 and video.shape[2] != 112:
+        h, w = 120, 160
+        h_crop_start = int((h - crop_size[0]) / 2)
+        w_crop_start = int((w - crop_size[1]) / 2)
+        video = tf.image.resize(video, (h, w), antialias=True).numpy()
+        video = video[:, h_crop_start:h_crop_start + crop_size[0], w_crop_start:w_crop_start + crop_size[1], :]
+
+    np.multiply(video, np.float32(1 / 255.), out=out)
+    return out
+
+
 class VideoClassCapsNetModel:
-    def __init__(self):
+    def __init__(self, weights=config.video_model, batch_sizes=(1, 2, 4, 8, 16)):
         self.class_names = [c.strip() for c in open(config.event_classes_ru, 'r', encoding='utf8').readlines()]
         self.num_classes = len(self.class_names)
 
         shape = (8, 112, 112, 3)
+        self.shape = shape
+
+        self.model = video_capsnet(self.num_classes, shape)
+        self.model.load_weights(weights).expect_partial()
+        self.inference = compile_inference_function(self.model, shape)
+
+        # clips are padded to one of these batch sizes, so the network always sees a few fixed shapes
+        self.batch_sizes = sorted(batch_sizes)
+        self.batch_buffers = {}
+        self.batch_lock = Lock()
+
+    def check_clip(self, video):
+        """Raise ValueError if `video` can not be preprocessed to the network input."""
+        frames, height, width, channels = self.shape
+        shape = getattr(video, 'shape', ())
+        if len(shape) != 4 or shape[0] != frames or shape[3] != channels or min(shape[1:3]) == 0:
+            raise ValueError(f'clip of shape {shape} is not a video of {frames} frames with {channels} channels')
+        if (shape[1] == height) != (shape[2] == width):
+            raise ValueError(f'clip of shape {shape} is neither {height}x{width} nor resizable to it')
+
+    def predict_batch(self, videos):
+        """Classify a list of clips with as few forward passes as possible.
+
+        Returns a list with (class name, confidence) for every clip.
+        """
+        if len(videos) == 0:
+            return []
+
+        def fill(buffer, s, e):
+            for i in range(s, e):
+                preprocess_video(videos[i], self.shape[1:3], buffer[i - s])
+
+        results = []
+        for pred in self._run_batches(len(videos), fill):
+            num = int(np.argmax(pred))
+            results.append((self.class_names[num], pred[num]))
+        return results
+
+    def _run_batches(self, n, fill):
+        """Run the network on `n` clips, `fill(buffer, s, e)` writes clips s..e into the padded batch buffer."""
+        predictions = []
+        max_batch_size = self.batch_sizes[-1]
+        with self.batch_lock:
+            for s in range(0, n, max_batch_size):
+                e = min(s + max_batch_size, n)
+                batch_size = next(size for size in self.batch_sizes if size >= e - s)
+
+                buffer = self.batch_buffers.get(batch_size)
+                if buffer is None:
+                    buffer = np.zeros((batch_size, *self.shape), np.float32)
+                    self.batch_buffers[batch_size] = buffer
+                fill(buffer, s, e)
 
-        inputs = Input(shape, name='input')
-        conv1 = Conv3D(filters=64, kernel_size=[3, 3, 3], padding='same', strides=[1, 1, 1],
-                       activation=tf.nn.relu, name='conv1')(inputs)
-        conv2 = Conv3D(filters=128, kernel_size=[3, 3, 3], padding='same', strides=[1, 2, 2],
-                       activation=tf.nn.relu, name='conv2')(conv1)
-        conv3 = Conv3D(filters=256, kernel_size=[3, 3, 3], padding='same', strides=[1, 1, 1],
-                       activation=tf.nn.relu, name='conv3')(conv2)
-        conv4 = Conv3D(filters=256, kernel_size=[3, 3, 3], padding='same', strides=[1, 2, 2],
-                       activation=tf.nn.relu, name='conv4')(conv3)
-        conv5 = Conv3D(filters=512, kernel_size=[3, 3, 3], padding='same', strides=[1, 1, 1],
-                       activation=tf.nn.relu, name='conv5')(conv4)
-        conv6 = Conv3D(filters=512, kernel_size=[3, 3, 3], padding='same', strides=[1, 1, 1],
-                       activation=tf.nn.relu, name='conv6')(conv5)
-        prim_caps = PrimaryCapsule3D(channels=32, kernel_size=[3, 9, 9], strides=[1, 1, 1], padding='valid',
-                                     name='prim_caps')(conv6)
-        sec_caps = ConvolutionalCapsule3D(channels=32, kernel_size=[3, 5, 5], strides=[1, 2, 2], padding='valid',
-                                          route_mean=True, name='sec_caps')(prim_caps)
-        pred_caps = ClassCapsule(n_caps_j=self.num_classes, subset_routing=-1, route_min=0.0, name='pred_caps',
-                                 coord_add=True,
-                                 ch_same_w=True)(sec_caps)
-        digit_preds = tf.reshape(pred_caps[1], (-1, self.num_classes))
-
-        self.model = tf.keras.Model(inputs, digit_preds)
-        self.model.load_weights(config.video_model).expect_partial()
-        self.model.make_predict_function()
-        self.model.predict(np.zeros((1, *shape)))
+                predictions.append(self.inference(buffer).numpy()[:e - s])
+        return np.concatenate(predictions, axis=0)
 
     def predict_short(self, video):
+        class_name, confidence = self.predict_batch([video])[0]
+        print(class_name, confidence)
+        return class_name, confidence
+
+    def predict_windows(self, video, stride=1, frame_step=1):
+        """Classify every window of 8 frames of a long video.
+
+        Parameters
+        ----------
+        video : ndarray
+            A uint8 video of shape (frames, height, width, 3).
+        stride : int
+            Number of frames between the starts of two windows.
+        frame_step : int
+            Windows take every `frame_step` frame, so one window spans 7 * frame_step + 1 frames.
+            Must match the frame subsampling used in training.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the first frame of every window and an array of shape (windows, num_classes) with
+            the scores of every window. Windows running past the end of the video are padded with zeros.
+
+        """
         n_frames = video.shape[0]
-        crop_size = (112, 112)
+        clip_length = self.shape[0]
+        span = (clip_length - 1) * frame_step + 1
 
-        # assumes a given aspect ratio of (240, 320). If given a cropped video, then no resizing occurs
-        if video.shape[1] != 112 and video.shape[2] != 112:
-            h, w = 120, 160
+        # all windows are strided views into one zero padded frame array
+        frames = np.zeros((n_frames + span - 1, *self.shape[1:]), np.float32)
+        preprocess_video(video, self.shape[1:3], frames[:n_frames])
 
-            video_res = np.zeros((n_frames, 120, 160, 3))
+        starts = np.arange(0, n_frames, stride)
+        windows = as_strided(frames, shape=(len(starts), clip_length, *frames.shape[1:]),
+                             strides=(stride * frames.strides[0], frame_step * frames.strides[0], *frames.strides[1:]),
+                             writeable=False)
 
-            for f in range(n_frames):
-                video_res[f] = imresize(video[f], (120, 160))
-        else:
-            h, w = 112, 112
-            video_res = video
-
-        # crops video to 112x112
-        margin_h = h - crop_size[0]
-        h_crop_start = int(margin_h / 2)
-        margin_w = w - crop_size[1]
-        w_crop_start = int(margin_w / 2)
-        video_cropped = video_res[:, h_crop_start:h_crop_start + crop_size[0], w_crop_start:w_crop_start + crop_size[1], :]
-        video_cropped = video_cropped / 255.
-
-        predictions = self.model.predict(np.expand_dims(video_cropped, axis=0))
-        fin_pred = np.mean(predictions, axis=0)
-
-        num = int(np.argmax(fin_pred))
-        confidence = fin_pred[num]
-        print(self.class_names[num], confidence)
-        return self.class_names[num], confidence
-
-    def predict_long(self, video):
-        n_frames = video.shape[0]
-        crop_size = (112, 112)
-
-        # assumes a given aspect ratio of (240, 320). If given a cropped video, then no resizing occurs
-        if video.shape[1] != 112 and video.shape[2] != 112:
-            h, w = 120, 160
+        def fill(buffer, s, e):
+            buffer[:e - s] = windows[s:e]
 
-            video_res = np.zeros((n_frames, 120, 160, 3))
+        return starts, self._run_batches(len(starts), fill)
 
-            for f in range(n_frames):
-                video_res[f] = imresize(video[f], (120, 160))
-        else:
-            h, w = 112, 112
-            video_res = video
+    def predict_long(self, video, stride=1, frame_step=1, return_scores=False):
+        """Classify a long video by the mean scores of its windows, see `predict_windows`.
 
-        # crops video to 112x112
-        margin_h = h - crop_size[0]
-        h_crop_start = int(margin_h / 2)
-        margin_w = w - crop_size[1]
-        w_crop_start = int(margin_w / 2)
-        video_cropped = video_res[:, h_crop_start:h_crop_start + crop_size[0], w_crop_start:w_crop_start + crop_size[1], :]
+        Returns the class name, with `return_scores` also the pooled scores, window starts and window scores.
+        """
+        starts, scores = self.predict_windows(video, stride, frame_step)
+        fin_pred = np.mean(scores, axis=0)
+        class_name = self.class_names[int(np.argmax(fin_pred))]
 
-        video_cropped = video_cropped / 255.
-
-        f_skip = 1
-        predictions = []
-        for i in range(0, n_frames, f_skip):
-            # if frames are skipped (subsampled) during training, they should also be skipped at test time
-            # creates a batch of video clips
-            x_batch = [[] for p in range(f_skip)]
-            for k in range(f_skip * 8):
-                if i + k >= n_frames:
-                    x_batch[k % f_skip].append(np.zeros_like(video_cropped[-1]))
-                else:
-                    x_batch[k % f_skip].append(video_cropped[i + k])
-            x_batch = [np.stack(x, axis=0) for x in x_batch]
-            x_batch = [np.expand_dims(x, axis=0) for x in x_batch]
-
-            # runs the network to get segmentations
-            pred = self.model.predict(x_batch[0])
-
-            predictions.append(pred)
-
-        predictions = np.concatenate(predictions, axis=0)
-        predictions = predictions.reshape((-1, self.num_classes))
-        fin_pred = np.mean(predictions, axis=0)
-
-        return self.class_names[int(np.argmax(fin_pred))]
+        if return_scores:
+            return class_name, fin_pred, starts, scores
+        return class_name
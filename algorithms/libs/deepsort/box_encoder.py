@@ -1,27 +1,16 @@
 import os
 import errno
 import argparse
+import time
+from threading import Lock
 import numpy as np
 import cv2
 import tensorflow as tf2
+from . import iou_matching
 
 tf = tf2.compat.v1
 
 
-def _run_in_batches(f, data_dict, out, batch_size):
-    data_len = len(out)
-    num_batches = int(data_len / batch_size)
-
-    s, e = 0, 0
-    for i in range(num_batches):
-        s, e = i * batch_size, (i + 1) * batch_size
-        batch_data_dict = {k: v[s:e] for k, v in data_dict.items()}
-        out[s:e] = f(batch_data_dict)
-    if e < len(out):
-        batch_data_dict = {k: v[e:] for k, v in data_dict.items()}
-        out[e:] = f(batch_data_dict)
-
-
 def extract_image_patch(image, bbox, patch_shape):
     """Extract image patch from bounding box.
 
@@ -69,48 +58,264 @@ def extract_image_patch(image, bbox, patch_shape):
     return image
 
 
+def extract_image_patches(image, boxes, patch_shape, out=None):
+    """Extract image patches of all bounding boxes with one crop and resize.
+
+    Parameters
+    ----------
+    image : ndarray
+        The full image.
+    boxes : array_like
+        An Nx4 matrix of bounding boxes in format (x, y, width, height).
+    patch_shape : array_like
+        The patch shape (height, width). As in `extract_image_patch`, every
+        box is first adapted to the aspect ratio of the patch shape, then it
+        is clipped at the image boundaries.
+    out : Optional[ndarray]
+        A uint8 buffer of shape (N, height, width, channels) the patches are
+        written to. If None, a new buffer is allocated.
+
+    Returns
+    -------
+    (ndarray, ndarray)
+        Returns the patch buffer and a boolean mask of boxes that could be
+        extracted. Patches of empty boxes or boxes fully outside of the image
+        are left unchanged.
+
+    """
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    if out is None:
+        out = np.zeros((len(boxes),) + tuple(patch_shape) + image.shape[2:], np.uint8)
+
+    # correct aspect ratio to patch shape
+    target_aspect = float(patch_shape[1]) / patch_shape[0]
+    new_width = target_aspect * boxes[:, 3]
+    boxes[:, 0] -= (new_width - boxes[:, 2]) / 2
+    boxes[:, 2] = new_width
+
+    # convert to top left, bottom right
+    boxes[:, 2:] += boxes[:, :2]
+    boxes = boxes.astype(np.int32)
+
+    # clip at image boundaries
+    height, width = image.shape[:2]
+    boxes[:, :2] = np.maximum(0, boxes[:, :2])
+    boxes[:, 2:] = np.minimum(np.asarray([width, height]) - 1, boxes[:, 2:])
+    valid = np.all(boxes[:, :2] < boxes[:, 2:], axis=1)
+    if not np.any(valid):
+        return out, valid
+
+    # crop_and_resize takes normalized (y1, x1, y2, x2) with inclusive bottom right corners
+    sx, sy, ex, ey = boxes[valid].T
+    crop_boxes = np.stack([sy / (height - 1), sx / (width - 1),
+                           (ey - 1) / (height - 1), (ex - 1) / (width - 1)], axis=1)
+    patches = tf2.image.crop_and_resize(image[np.newaxis], crop_boxes.astype(np.float32),
+                                        np.zeros(len(crop_boxes), np.int32), tuple(patch_shape))
+    out[:len(boxes)][valid] = np.clip(np.rint(patches.numpy()), 0, 255)
+    return out, valid
+
+
 class ImageEncoder(object):
+    """
+    Re-ID network loaded from a frozen graph and wrapped into a TF2 concrete
+    function, so it runs in the same eager runtime as the detection model.
+
+    Batches are padded to the smallest of `bucket_sizes` that fits them, which
+    keeps the set of input shapes fixed. Padding buffers are preallocated once
+    per bucket.
+
+    Parameters
+    ----------
+    checkpoint_filename : str
+        Path to the frozen inference graph protobuf.
+    input_name : str
+        Name of the uint8 image input tensor.
+    output_name : str
+        Name of the feature output tensor.
+    bucket_sizes : Iterable[int]
+        Batch sizes the encoder is run with.
+
+    """
 
-    def __init__(self, checkpoint_filename, input_name="images", output_name="features"):
-        self.session = tf.Session()
-        with tf.gfile.GFile(checkpoint_filename, "rb") as file_handle:
+    def __init__(self, checkpoint_filename, input_name="images", output_name="features",
+                 bucket_sizes=(1, 2, 4, 8, 16, 32, 64)):
+        with tf2.io.gfile.GFile(checkpoint_filename, "rb") as file_handle:
             graph_def = tf.GraphDef()
             graph_def.ParseFromString(file_handle.read())
-        tf.import_graph_def(graph_def, name="net")
-        self.input_var = tf.get_default_graph().get_tensor_by_name("%s:0" % input_name)
-        self.output_var = tf.get_default_graph().get_tensor_by_name("%s:0" % output_name)
 
-        assert len(self.output_var.get_shape()) == 2
-        assert len(self.input_var.get_shape()) == 4
-        self.feature_dim = self.output_var.get_shape().as_list()[-1]
-        self.image_shape = self.input_var.get_shape().as_list()[1:]
+        def _import_graph_def():
+            tf.import_graph_def(graph_def, name="net")
+
+        wrapped_import = tf.wrap_function(_import_graph_def, [])
+        input_var = wrapped_import.graph.get_tensor_by_name("%s:0" % input_name)
+        output_var = wrapped_import.graph.get_tensor_by_name("%s:0" % output_name)
+
+        assert len(output_var.get_shape()) == 2
+        assert len(input_var.get_shape()) == 4
+        self.feature_dim = output_var.get_shape().as_list()[-1]
+        self.image_shape = input_var.get_shape().as_list()[1:]
+        self.inference = wrapped_import.prune(input_var, output_var)
+
+        self.bucket_sizes = sorted(bucket_sizes)
+        self.buffers = {size: np.zeros([size] + self.image_shape, np.uint8) for size in self.bucket_sizes}
+        self.lock = Lock()
+
+        # bucket size -> [number of runs, number of patches, seconds]
+        self.stats = {size: [0, 0, 0.] for size in self.bucket_sizes}
 
     def __call__(self, data_x, batch_size=32):
+        """Compute features of a uint8 patch batch of shape (N, height, width, 3)."""
         out = np.zeros((len(data_x), self.feature_dim), np.float32)
-        _run_in_batches(lambda x: self.session.run(self.output_var, feed_dict=x),
-                        {self.input_var: data_x}, out, batch_size)
+        batch_size = min(batch_size, self.bucket_sizes[-1])
+        with self.lock:
+            for s in range(0, len(data_x), batch_size):
+                e = min(s + batch_size, len(data_x))
+                out[s:e] = self._run_bucket(data_x[s:e])
         return out
 
+    def _run_bucket(self, patches):
+        n = len(patches)
+        bucket = next(size for size in self.bucket_sizes if size >= n)
+        if n == bucket and patches.dtype == np.uint8:
+            batch = patches
+        else:
+            batch = self.buffers[bucket]
+            batch[:n] = patches
+
+        start = time.time()
+        features = self.inference(tf2.convert_to_tensor(batch)).numpy()
+        stats = self.stats[bucket]
+        stats[0] += 1
+        stats[1] += n
+        stats[2] += time.time() - start
+        return features[:n]
+
+    def get_stats(self):
+        """Return runs, mean latency and throughput in patches per second for every used bucket size."""
+        with self.lock:
+            return {size: {'runs': runs, 'patches': patches,
+                           'latency_ms': seconds * 1000 / runs,
+                           'patches_per_second': patches / seconds if seconds > 0 else 0.}
+                    for size, (runs, patches, seconds) in self.stats.items() if runs > 0}
+
 
 def create_box_encoder(model_filename, input_name="images",
                        output_name="features", batch_size=32):
     image_encoder = ImageEncoder(model_filename, input_name, output_name)
     image_shape = image_encoder.image_shape
 
+    # patch buffer reused across frames, grown when a frame has more boxes
+    buffers = [np.zeros([batch_size] + image_shape, np.uint8)]
+    lock = Lock()
+
     def encoder(image, boxes):
-        image_patches = []
-        for box in boxes:
-            patch = extract_image_patch(image, box, image_shape[:2])
-            if patch is None:
-                print("WARNING: Failed to extract image patch: %s." % str(box))
-                patch = np.random.uniform(0., 255., image_shape).astype(np.uint8)
-            image_patches.append(patch)
-        image_patches = np.asarray(image_patches)
-        return image_encoder(image_patches, batch_size)
+        boxes = np.asarray(boxes).reshape(-1, 4)
+        with lock:
+            if len(boxes) > len(buffers[0]):
+                buffers[0] = np.zeros([2 * len(boxes)] + image_shape, np.uint8)
+            image_patches, valid = extract_image_patches(image, boxes, image_shape[:2], buffers[0][:len(boxes)])
+            for i in np.flatnonzero(~valid):
+                print("WARNING: Failed to extract image patch: %s." % str(boxes[i]))
+                image_patches[i] = np.random.uniform(0., 255., image_shape).astype(np.uint8)
+            return image_encoder(image_patches, batch_size)
 
     return encoder
 
 
+class CachedBoxEncoder(object):
+    """
+    Wraps a box encoder and reuses the embedding of a confirmed track instead
+    of running the re-ID network again while the track's box stays stable.
+
+    A detection box reuses a cached embedding if its IoU with the box the
+    embedding was computed for is at least `iou_threshold` and the embedding
+    has been reused less than `max_reuse` times. All other boxes are encoded
+    in one batch.
+
+    Parameters
+    ----------
+    encoder : Callable[(ndarray, ndarray), ndarray]
+        The box encoder, see `create_box_encoder`.
+    iou_threshold : float
+        Minimum IoU between a box and the cached box to reuse the embedding.
+    max_reuse : int
+        Number of frames an embedding may be reused before it is recomputed.
+
+    """
+
+    def __init__(self, encoder, iou_threshold=0.9, max_reuse=5):
+        self.encoder = encoder
+        self.iou_threshold = iou_threshold
+        self.max_reuse = max_reuse
+
+        # track id -> (feature, box at encoding time, times reused)
+        self.entries = {}
+        # box of the current frame -> (feature, box at encoding time, times reused)
+        self.frame_entries = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, image, boxes):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        features = [None] * len(boxes)
+        self.frame_entries = {}
+
+        if len(boxes) > 0 and len(self.entries) > 0:
+            entries = list(self.entries.values())
+            cached_boxes = np.asarray([entry[1] for entry in entries])
+            ious = iou_matching.iou_matrix(boxes, cached_boxes)
+            taken = set()
+            for i in np.argsort(-ious.max(axis=1)):
+                j = int(np.argmax(ious[i]))
+                feature, encoded_box, reused = entries[j]
+                if j in taken or ious[i, j] < self.iou_threshold or reused >= self.max_reuse:
+                    continue
+                taken.add(j)
+                features[i] = feature
+                self.frame_entries[tuple(boxes[i])] = (feature, encoded_box, reused + 1)
+
+        missed = [i for i, feature in enumerate(features) if feature is None]
+        self.hits += len(boxes) - len(missed)
+        self.misses += len(missed)
+        if len(missed) > 0:
+            encoded = self.encoder(image, boxes[missed])
+            for i, feature in zip(missed, encoded):
+                features[i] = feature
+                self.frame_entries[tuple(boxes[i])] = (feature, boxes[i], 0)
+
+        return np.asarray(features)
+
+    def update(self, tracks):
+        """Remember the embeddings of confirmed tracks that were updated in the current frame.
+
+        Parameters
+        ----------
+        tracks : List[track.Track]
+            The tracks after the tracker update of the current frame.
+
+        """
+        entries = {}
+        for track in tracks:
+            if not track.is_confirmed() or track.time_since_update > 0 or track.last_tlwh is None:
+                continue
+            entry = self.frame_entries.get(tuple(track.last_tlwh))
+            if entry is not None:
+                entries[track.track_id] = entry
+        self.entries = entries
+
+    def clear(self):
+        self.entries = {}
+        self.frame_entries = {}
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate(), 'cached': len(self.entries)}
+
+
 def generate_detections(encoder, mot_dir, output_dir, detection_dir=None):
     """Generate detections with features.
 
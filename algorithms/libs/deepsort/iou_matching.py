@@ -1,6 +1,7 @@
 from __future__ import absolute_import
 import numpy as np
 from . import linear_assignment
+from .track import track_rows
 
 
 def iou(bbox, candidates):
@@ -38,6 +39,40 @@ def iou(bbox, candidates):
     return area_intersection / (area_bbox + area_candidates - area_intersection)
 
 
+def iou_matrix(bboxes, candidates):
+    """Compute pair-wise intersection over union.
+
+    Parameters
+    ----------
+    bboxes : ndarray
+        A Tx4 matrix of bounding boxes in format `(top left x, top left y,
+        width, height)`.
+    candidates : ndarray
+        A Dx4 matrix of candidate bounding boxes in the same format as
+        `bboxes`.
+
+    Returns
+    -------
+    ndarray
+        Returns a TxD matrix, where element (i, j) contains the intersection
+        over union between `bboxes[i]` and `candidates[j]`.
+
+    """
+    bboxes_tl = bboxes[:, np.newaxis, :2]
+    bboxes_br = bboxes_tl + bboxes[:, np.newaxis, 2:]
+    candidates_tl = candidates[np.newaxis, :, :2]
+    candidates_br = candidates_tl + candidates[np.newaxis, :, 2:]
+
+    tl = np.maximum(bboxes_tl, candidates_tl)
+    br = np.minimum(bboxes_br, candidates_br)
+    wh = np.maximum(0., br - tl)
+
+    area_intersection = wh[:, :, 0] * wh[:, :, 1]
+    area_bboxes = bboxes[:, 2] * bboxes[:, 3]
+    area_candidates = candidates[:, 2] * candidates[:, 3]
+    return area_intersection / (area_bboxes[:, np.newaxis] + area_candidates[np.newaxis, :] - area_intersection)
+
+
 def iou_cost(tracks, detections, track_indices=None,
              detection_indices=None):
     """An intersection over union distance metric.
@@ -68,13 +103,21 @@ def iou_cost(tracks, detections, track_indices=None,
     if detection_indices is None:
         detection_indices = np.arange(len(detections))
 
-    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
-    for row, track_idx in enumerate(track_indices):
-        if tracks[track_idx].time_since_update > 1:
-            cost_matrix[row, :] = linear_assignment.INFTY_COST
-            continue
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return np.zeros((len(track_indices), len(detection_indices)))
+
+    # (x, y, a, h) -> (top left x, top left y, width, height) for all tracks at once
+    states, rows = track_rows([tracks[i] for i in track_indices])
+    if states is not None:
+        bboxes = states.means[rows, :4]
+        too_old = states.times_since_update[rows] > 1
+    else:
+        bboxes = np.asarray([tracks[i].mean[:4] for i in track_indices], dtype=np.float64)
+        too_old = np.asarray([tracks[i].time_since_update > 1 for i in track_indices])
+    bboxes[:, 2] *= bboxes[:, 3]
+    bboxes[:, :2] -= bboxes[:, 2:] / 2
+    candidates = np.asarray([detections[i].tlwh for i in detection_indices], dtype=np.float64)
 
-        bbox = tracks[track_idx].to_tlwh()
-        candidates = np.asarray([detections[i].tlwh for i in detection_indices])
-        cost_matrix[row, :] = 1. - iou(bbox, candidates)
+    cost_matrix = 1. - iou_matrix(bboxes, candidates)
+    cost_matrix[too_old, :] = linear_assignment.INFTY_COST
     return cost_matrix
@@ -226,3 +226,187 @@ class KalmanFilter(object):
             overwrite_b=True)
         squared_maha = np.sum(z * z, axis=0)
         return squared_maha
+
+    def multi_predict(self, mean, covariance):
+        """Run Kalman filter prediction step for many tracks at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of object states at the previous time
+            step.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the object states at
+            the previous time step.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx8 mean matrix and Nx8x8 covariance matrices of the
+            predicted states.
+
+        """
+        std_pos = [
+            self._std_weight_position * mean[:, 3],
+            self._std_weight_position * mean[:, 3],
+            1e-2 * np.ones_like(mean[:, 3]),
+            self._std_weight_position * mean[:, 3]]
+        std_vel = [
+            self._std_weight_velocity * mean[:, 3],
+            self._std_weight_velocity * mean[:, 3],
+            1e-5 * np.ones_like(mean[:, 3]),
+            self._std_weight_velocity * mean[:, 3]]
+        sqr = np.square(np.asarray(std_pos + std_vel)).T
+
+        motion_cov = _batch_diag(sqr)
+
+        mean = np.dot(mean, self._motion_mat.T)
+        covariance = np.matmul(np.matmul(
+            self._motion_mat, covariance), self._motion_mat.T) + motion_cov
+
+        return mean, covariance
+
+    def multi_project(self, mean, covariance):
+        """Project many state distributions to measurement space.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state means.
+        covariance : ndarray
+            The Nx8x8 dimensional state covariance matrices.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 projected covariance
+            matrices.
+
+        """
+        std = [
+            self._std_weight_position * mean[:, 3],
+            self._std_weight_position * mean[:, 3],
+            1e-1 * np.ones_like(mean[:, 3]),
+            self._std_weight_position * mean[:, 3]]
+        innovation_cov = _batch_diag(np.square(np.asarray(std)).T)
+
+        mean = np.dot(mean, self._update_mat.T)
+        covariance = np.matmul(np.matmul(
+            self._update_mat, covariance), self._update_mat.T)
+        return mean, covariance + innovation_cov
+
+    def multi_cholesky_project(self, mean, covariance):
+        """Project many state distributions to measurement space and factorize
+        the projected covariances.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state means.
+        covariance : ndarray
+            The Nx8x8 dimensional state covariance matrices.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and the Nx4x4 lower Cholesky
+            factors of the projected covariance matrices.
+
+        """
+        mean, covariance = self.multi_project(mean, covariance)
+        return mean, np.linalg.cholesky(covariance)
+
+    def multi_update(self, mean, covariance, measurements):
+        """Run Kalman filter correction step for many tracks at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of predicted state means.
+        covariance : ndarray
+            The Nx8x8 dimensional state covariance matrices.
+        measurements : ndarray
+            The Nx4 dimensional matrix of measurements (x, y, a, h), where the
+            i-th row is associated with the i-th state.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+
+        """
+        projected_mean, projected_cov = self.multi_project(mean, covariance)
+
+        # K = P H^T S^-1, S is symmetric so solve S K^T = H P
+        kalman_gain = np.linalg.solve(
+            projected_cov, np.matmul(self._update_mat, covariance)).transpose((0, 2, 1))
+        innovation = measurements - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - np.matmul(np.matmul(
+            kalman_gain, projected_cov), kalman_gain.transpose((0, 2, 1)))
+        return new_mean, new_covariance
+
+    def multi_gating_distance(self, mean, covariance, measurements,
+                              only_position=False, projection=None):
+        """Compute gating distances between many state distributions and
+        measurements.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional matrix of state means.
+        covariance : ndarray
+            The Nx8x8 dimensional state covariance matrices.
+        measurements : ndarray
+            An Mx4 dimensional matrix of M measurements in format (x, y, a, h).
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+        projection : Optional[(ndarray, ndarray)]
+            The Nx4 projected means and Nx4x4 lower Cholesky factors of the
+            projected covariances, see `multi_cholesky_project`. If given,
+            `mean` and `covariance` are not projected again.
+
+        Returns
+        -------
+        ndarray
+            Returns an NxM matrix, where element (i, j) contains the squared
+            Mahalanobis distance between the i-th state distribution and
+            `measurements[j]`.
+
+        """
+        if projection is None:
+            projection = self.multi_cholesky_project(mean, covariance)
+        mean, cholesky_factor = projection
+        if only_position:
+            # the Cholesky factor of a leading block is the leading block of the factor
+            mean, cholesky_factor = mean[:, :2], cholesky_factor[:, :2, :2]
+            measurements = measurements[:, :2]
+
+        # differences laid out as (dim, tracks, measurements), so every step
+        # of the substitution works on contiguous NxM planes
+        d = measurements.T[:, np.newaxis, :] - mean.T[:, :, np.newaxis]
+        z = _batch_solve_lower_triangular(cholesky_factor, d)
+        squared_maha = np.sum(z * z, axis=0)
+        return squared_maha
+
+
+def _batch_diag(values):
+    """Build a stack of diagonal matrices from an NxD matrix of diagonals."""
+    n, dim = values.shape
+    diag = np.zeros((n, dim, dim))
+    diag[:, np.arange(dim), np.arange(dim)] = values
+    return diag
+
+
+def _batch_solve_lower_triangular(lower, b):
+    """Solve `lower[n] x[:, n, m] = b[:, n, m]` by forward substitution for a
+    stack of NxDxD lower triangular matrices and DxNxM right-hand sides."""
+    x = np.empty(b.shape)
+    for i in range(lower.shape[1]):
+        x[i] = b[i]
+        for k in range(i):
+            x[i] -= lower[:, i, k, np.newaxis] * x[k]
+        x[i] /= lower[:, i, i, np.newaxis]
+    return x
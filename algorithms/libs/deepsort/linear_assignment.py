@@ -2,6 +2,7 @@ from __future__ import absolute_import
 import numpy as np
 from scipy.optimize import linear_sum_assignment
 from . import kalman_filter
+from .track import track_rows
 
 
 INFTY_COST = 1e+5
@@ -114,16 +115,21 @@ def matching_cascade(distance_metric, max_distance, cascade_depth, tracks, detec
     if detection_indices is None:
         detection_indices = list(range(len(detections)))
 
+    # frames since the last update of every candidate, read once for all levels
+    states, rows = track_rows([tracks[k] for k in track_indices])
+    if states is not None:
+        times_since_update = states.times_since_update[rows]
+    else:
+        times_since_update = np.asarray([tracks[k].time_since_update for k in track_indices])
+    candidates = np.asarray(track_indices, np.int64)
+
     unmatched_detections = detection_indices
     matches = []
     for level in range(cascade_depth):
         if len(unmatched_detections) == 0:  # No detections left
             break
 
-        track_indices_l = [
-            k for k in track_indices
-            if tracks[k].time_since_update == 1 + level
-        ]
+        track_indices_l = candidates[times_since_update == 1 + level].tolist()
         if len(track_indices_l) == 0:  # Nothing to match at this level
             continue
 
@@ -176,9 +182,27 @@ def gate_cost_matrix(
     gating_threshold = kalman_filter.chi2inv95[gating_dim]
     measurements = np.asarray(
         [detections[i].to_xyah() for i in detection_indices])
-    for row, track_idx in enumerate(track_indices):
-        track = tracks[track_idx]
-        gating_distance = kf.gating_distance(
-            track.mean, track.covariance, measurements, only_position)
-        cost_matrix[row, gating_distance > gating_threshold] = gated_cost
+    if len(track_indices) == 0 or len(measurements) == 0:
+        return cost_matrix
+
+    gated_tracks = [tracks[i] for i in track_indices]
+    states, rows = track_rows(gated_tracks)
+    projection = None
+    if states is not None:
+        # gather straight from the tracker arrays
+        mean, covariance = states.means[rows], states.covariances[rows]
+        if states.projected[rows].all():
+            projection = (states.projected_means[rows], states.cholesky_factors[rows])
+    else:
+        mean = np.asarray([track.mean for track in gated_tracks])
+        covariance = np.asarray([track.covariance for track in gated_tracks])
+
+        # reuse the projection computed once per frame by the tracker if it is available
+        if all(track.projection is not None for track in gated_tracks):
+            projection = (np.asarray([track.projection[0] for track in gated_tracks]),
+                          np.asarray([track.projection[1] for track in gated_tracks]))
+
+    gating_distance = kf.multi_gating_distance(
+        mean, covariance, measurements, only_position, projection)
+    cost_matrix[gating_distance > gating_threshold] = gated_cost
     return cost_matrix
@@ -100,6 +100,11 @@ class NearestNeighborDistanceMetric(object):
     A nearest neighbor distance metric that, for each target, returns
     the closest distance to any sample that has been observed so far.
 
+    Samples are kept in a preallocated gallery of shape
+    `(targets, budget, feature_dim)` used as a ring buffer per target, so
+    adding a sample is O(1) and the distance between all targets and all
+    features is a single matrix product followed by a min reduction.
+
     Parameters
     ----------
     metric : str
@@ -109,28 +114,41 @@ class NearestNeighborDistanceMetric(object):
         invalid match.
     budget : Optional[int]
         If not None, fix samples per class to at most this number. Removes
-        the oldest samples when the budget is reached.
+        the oldest samples when the budget is reached. If None, the gallery
+        grows as needed.
+    feature_dim : int
+        Dimensionality of the feature vectors.
 
     Attributes
     ----------
-    samples : Dict[int -> List[ndarray]]
-        A dictionary that maps from target identities to the list of samples
-        that have been observed so far.
+    gallery : ndarray
+        A float32 array of shape `(capacity, slots, feature_dim)` with the
+        samples of every target. Samples are normalized to unit length for the
+        cosine metric.
+    slots : Dict[int -> int]
+        A dictionary that maps from target identities to rows of `gallery`.
 
     """
 
-    def __init__(self, metric, matching_threshold, budget=None):
+    def __init__(self, metric, matching_threshold, budget=None, feature_dim=128, initial_capacity=32):
 
         if metric == "euclidean":
-            self._metric = _nn_euclidean_distance
+            self._normalize = False
         elif metric == "cosine":
-            self._metric = _nn_cosine_distance
+            self._normalize = True
         else:
             raise ValueError(
                 "Invalid metric; must be either 'euclidean' or 'cosine'")
+        self.metric = metric
         self.matching_threshold = matching_threshold
         self.budget = budget
-        self.samples = {}
+
+        n_slots = budget if budget is not None else initial_capacity
+        self.gallery = np.zeros((initial_capacity, n_slots, feature_dim), np.float32)
+        self.counts = np.zeros(initial_capacity, np.int64)
+        self.heads = np.zeros(initial_capacity, np.int64)
+        self.slots = {}
+        self._free_rows = list(range(initial_capacity - 1, -1, -1))
 
     def partial_fit(self, features, targets, active_targets):
         """Update the distance metric with new data.
@@ -145,11 +163,29 @@ class NearestNeighborDistanceMetric(object):
             A list of targets that are currently present in the scene.
 
         """
+        features = np.asarray(features, dtype=np.float32)
+        if self._normalize and len(features) > 0:
+            features = features / np.linalg.norm(features, axis=1, keepdims=True)
+
         for feature, target in zip(features, targets):
-            self.samples.setdefault(target, []).append(feature)
+            row = self.slots.get(target)
+            if row is None:
+                row = self._allocate_row(target)
+            if self.budget is None and self.heads[row] == self.gallery.shape[1]:
+                self._grow_slots()
+
+            self.gallery[row, self.heads[row]] = feature
+            self.heads[row] += 1
             if self.budget is not None:
-                self.samples[target] = self.samples[target][-self.budget:]
-        self.samples = {k: self.samples[k] for k in active_targets}
+                self.heads[row] %= self.budget
+            self.counts[row] = min(self.counts[row] + 1, self.gallery.shape[1])
+
+        active_targets = set(active_targets)
+        for target in [t for t in self.slots if t not in active_targets]:
+            row = self.slots.pop(target)
+            self.counts[row] = 0
+            self.heads[row] = 0
+            self._free_rows.append(row)
 
     def distance(self, features, targets):
         """Compute distance between features and targets.
@@ -169,7 +205,38 @@ class NearestNeighborDistanceMetric(object):
             `targets[i]` and `features[j]`.
 
         """
-        cost_matrix = np.zeros((len(targets), len(features)))
-        for i, target in enumerate(targets):
-            cost_matrix[i, :] = self._metric(self.samples[target], features)
-        return cost_matrix
+        if len(targets) == 0 or len(features) == 0:
+            return np.zeros((len(targets), len(features)))
+
+        features = np.asarray(features, dtype=np.float32)
+        rows = np.asarray([self.slots[target] for target in targets])
+        samples = self.gallery[rows]
+        n_targets, n_slots, feature_dim = samples.shape
+        valid = np.arange(n_slots)[np.newaxis, :] < self.counts[rows][:, np.newaxis]
+
+        if self._normalize:
+            features = features / np.linalg.norm(features, axis=1, keepdims=True)
+            similarity = np.dot(samples.reshape(-1, feature_dim), features.T).reshape(n_targets, n_slots, -1)
+            similarity[~valid] = -np.inf
+            cost_matrix = 1. - similarity.max(axis=1)
+        else:
+            distances = -2. * np.dot(samples.reshape(-1, feature_dim), features.T).reshape(n_targets, n_slots, -1)
+            distances += np.square(samples).sum(axis=2)[:, :, np.newaxis]
+            distances += np.square(features).sum(axis=1)[np.newaxis, np.newaxis, :]
+            distances[~valid] = np.inf
+            cost_matrix = np.maximum(0.0, distances.min(axis=1))
+        return cost_matrix.astype(np.float64)
+
+    def _allocate_row(self, target):
+        if len(self._free_rows) == 0:
+            capacity = len(self.gallery)
+            self.gallery = np.concatenate([self.gallery, np.zeros_like(self.gallery)], axis=0)
+            self.counts = np.concatenate([self.counts, np.zeros(capacity, np.int64)])
+            self.heads = np.concatenate([self.heads, np.zeros(capacity, np.int64)])
+            self._free_rows = list(range(2 * capacity - 1, capacity - 1, -1))
+        row = self._free_rows.pop()
+        self.slots[target] = row
+        return row
+
+    def _grow_slots(self):
+        self.gallery = np.concatenate([self.gallery, np.zeros_like(self.gallery)], axis=1)
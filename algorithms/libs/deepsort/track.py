@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class TrackState:
     """
     Enumeration type for the single target track state. Newly created tracks are
@@ -13,6 +16,97 @@ class TrackState:
     Deleted = 3
 
 
+class TrackStates:
+    """
+    Kalman filter state and counters of all tracks of a tracker, kept
+    contiguously so prediction and correction run on array slices. Row `i`
+    belongs to the track with `row == i`, rows `0..size - 1` are in use.
+
+    Attributes
+    ----------
+    means : ndarray
+        The Nx8 state means.
+    covariances : ndarray
+        The Nx8x8 state covariances.
+    projected_means : ndarray
+        The Nx4 means projected to measurement space.
+    cholesky_factors : ndarray
+        The Nx4x4 lower Cholesky factors of the projected covariances.
+    projected : ndarray
+        Whether the projection of a row is valid for the current state.
+    ages : ndarray
+        Total number of frames since first occurrence.
+    times_since_update : ndarray
+        Total number of frames since the last measurement update.
+
+    """
+
+    FIELDS = ('means', 'covariances', 'projected_means', 'cholesky_factors', 'projected', 'ages',
+              'times_since_update')
+
+    def __init__(self, capacity=32):
+        self.size = 0
+        self.means = np.zeros((capacity, 8))
+        self.covariances = np.zeros((capacity, 8, 8))
+        self.projected_means = np.zeros((capacity, 4))
+        self.cholesky_factors = np.zeros((capacity, 4, 4))
+        self.projected = np.zeros(capacity, bool)
+        self.ages = np.zeros(capacity, np.int64)
+        self.times_since_update = np.zeros(capacity, np.int64)
+
+    def append(self, track):
+        """Move the state of a track into the next free row."""
+        if self.size == len(self.means):
+            for name in self.FIELDS:
+                array = getattr(self, name)
+                grown = np.zeros((2 * len(array),) + array.shape[1:], array.dtype)
+                grown[:len(array)] = array
+                setattr(self, name, grown)
+
+        row = self.size
+        self.size += 1
+        track.attach(self, row)
+
+    def compact(self, tracks):
+        """Keep the rows of `tracks` only, in their order."""
+        rows = [track.row for track in tracks]
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            array[:len(rows)] = array[rows]
+        for i, track in enumerate(tracks):
+            track.row = i
+        self.size = len(rows)
+
+
+def track_rows(tracks):
+    """Return the `TrackStates` of `tracks` and their rows, or (None, None) if they do not share one."""
+    states = tracks[0].states if len(tracks) > 0 else None
+    if states is None or any(track.states is not states for track in tracks):
+        return None, None
+    return states, np.asarray([track.row for track in tracks], np.int64)
+
+
+class _StateField:
+    """A track attribute kept in a row of `TrackStates` once the track is attached to one."""
+
+    def __init__(self, name, field):
+        self.name = name
+        self.field = field
+
+    def __get__(self, track, owner):
+        if track is None:
+            return self
+        if track.states is None:
+            return track.__dict__[self.name]
+        return getattr(track.states, self.field)[track.row]
+
+    def __set__(self, track, value):
+        if track.states is None:
+            track.__dict__[self.name] = value
+        else:
+            getattr(track.states, self.field)[track.row] = value
+
+
 class Track:
     """
     A single target track with state space `(x, y, a, h)` and associated
@@ -57,11 +151,30 @@ class Track:
     features : List[ndarray]
         A cache of features. On each measurement update, the associated feature
         vector is added to this list.
+    projection : Optional[(ndarray, ndarray)]
+        The projected mean and the lower Cholesky factor of the projected
+        covariance of the current state, if computed by the tracker for this
+        time step.
+    last_tlwh : Optional[ndarray]
+        Bounding box of the last associated detection.
+    states : Optional[TrackStates]
+        The arrays of the tracker that hold `mean`, `covariance`,
+        `projection`, `age` and `time_since_update` in row `row`. A track
+        that is not attached keeps them itself.
 
     """
 
+    mean = _StateField('mean', 'means')
+    covariance = _StateField('covariance', 'covariances')
+    age = _StateField('age', 'ages')
+    time_since_update = _StateField('time_since_update', 'times_since_update')
+
     def __init__(self, mean, covariance, track_id, n_init, max_age, score,
                  feature=None, class_name=None, class_id=0):
+        self.states = None
+        self.row = None
+        self._projection = None
+
         self.mean = mean
         self.covariance = covariance
         self.track_id = track_id
@@ -73,6 +186,8 @@ class Track:
         self.features = []
         if feature is not None:
             self.features.append(feature)
+        self.projection = None
+        self.last_tlwh = None
 
         self._n_init = n_init
         self._max_age = max_age
@@ -80,6 +195,51 @@ class Track:
         self.class_name = class_name
         self.class_id = class_id
 
+    @property
+    def projection(self):
+        if self.states is None:
+            return self._projection
+        if not self.states.projected[self.row]:
+            return None
+        return self.states.projected_means[self.row], self.states.cholesky_factors[self.row]
+
+    @projection.setter
+    def projection(self, value):
+        if self.states is None:
+            self._projection = value
+        elif value is None:
+            self.states.projected[self.row] = False
+        else:
+            self.states.projected_means[self.row], self.states.cholesky_factors[self.row] = value
+            self.states.projected[self.row] = True
+
+    def attach(self, states, row):
+        """Move the state of the track into row `row` of `states`."""
+        values = self.mean, self.covariance, self.projection, self.age, self.time_since_update
+        for name in ('mean', 'covariance', 'age', 'time_since_update'):
+            self.__dict__.pop(name, None)
+        self.states, self.row = states, row
+        self.mean, self.covariance, self.projection, self.age, self.time_since_update = values
+
+    def detach(self):
+        """Take a copy of the state out of the tracker arrays, e.g. when the track is removed."""
+        if self.states is None:
+            return
+        projection = self.projection
+        values = self.mean.copy(), self.covariance.copy(), int(self.age), int(self.time_since_update)
+        self.states, self.row = None, None
+        self.mean, self.covariance, self.age, self.time_since_update = values
+        self.projection = None if projection is None else (projection[0].copy(), projection[1].copy())
+
+    def __copy__(self):
+        # a copy is a snapshot, it must not follow the tracker arrays
+        track = Track.__new__(Track)
+        track.__dict__.update(self.__dict__)
+        track.features = list(self.features)
+        if self.states is not None:
+            track.detach()
+        return track
+
     def to_tlwh(self):
         """Get current position in bounding box format `(top left x, top left y,
         width, height)`.
@@ -125,7 +285,23 @@ class Track:
             The Kalman filter.
 
         """
-        self.mean, self.covariance = kf.predict(self.mean, self.covariance)
+        mean, covariance = kf.predict(self.mean, self.covariance)
+        self.apply_predict(mean, covariance)
+
+    def apply_predict(self, mean, covariance):
+        """Set the state distribution predicted for the current time step, e.g.
+        by `KalmanFilter.multi_predict` for all tracks at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The predicted mean vector (8 dimensional).
+        covariance : ndarray
+            The predicted covariance matrix (8x8 dimensional).
+
+        """
+        self.mean, self.covariance = mean, covariance
+        self.projection = None
         self.age += 1
         self.time_since_update += 1
 
@@ -141,13 +317,44 @@ class Track:
             The associated detection.
 
         """
-        self.mean, self.covariance = kf.update(
+        mean, covariance = kf.update(
             self.mean, self.covariance, detection.to_xyah())
+        self.apply_update(mean, covariance, detection)
+
+    def apply_update(self, mean, covariance, detection):
+        """Set the measurement-corrected state distribution, e.g. computed by
+        `KalmanFilter.multi_update` for all matched tracks at once, and update
+        the feature cache.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The corrected mean vector (8 dimensional).
+        covariance : ndarray
+            The corrected covariance matrix (8x8 dimensional).
+        detection : Detection
+            The associated detection.
+
+        """
+        self.mean, self.covariance = mean, covariance
+        self.projection = None
+        self.time_since_update = 0
+        self.mark_hit(detection)
+
+    def mark_hit(self, detection):
+        """Register the associated detection once the tracker has corrected the state in its arrays.
+
+        Parameters
+        ----------
+        detection : Detection
+            The associated detection.
+
+        """
+        self.last_tlwh = detection.tlwh
         self.features.append(detection.feature)
         self.score = detection.get_confidence()
 
         self.hits += 1
-        self.time_since_update = 0
         if self.state == TrackState.Tentative and self.hits >= self._n_init:
             self.state = TrackState.Confirmed
 
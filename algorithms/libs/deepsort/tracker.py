@@ -3,7 +3,7 @@ import numpy as np
 from . import kalman_filter
 from . import linear_assignment
 from . import iou_matching
-from .track import Track
+from .track import Track, TrackStates
 
 
 class Tracker:
@@ -20,6 +20,10 @@ class Tracker:
         Number of consecutive detections before the track is confirmed. The
         track state is set to `Deleted` if a miss occurs within the first
         `n_init` frames.
+    batch_kalman : bool
+        If True, the Kalman filter prediction and correction steps run for all
+        tracks at once on the `(N, 8)` means and `(N, 8, 8)` covariances in
+        `states`.
 
     Attributes
     ----------
@@ -33,17 +37,21 @@ class Tracker:
         A Kalman filter to filter target trajectories in image space.
     tracks : List[Track]
         The list of active tracks at the current time step.
+    states : track.TrackStates
+        The Kalman filter state of the active tracks, track `i` in row `i`.
 
     """
 
-    def __init__(self, metric, max_iou_distance=0.5, max_age=30, n_init=3, num_classes=80):
+    def __init__(self, metric, max_iou_distance=0.5, max_age=30, n_init=3, num_classes=80, batch_kalman=True):
         self.metric = metric
         self.max_iou_distance = max_iou_distance
         self.max_age = max_age
         self.n_init = n_init
+        self.batch_kalman = batch_kalman
 
         self.kf = kalman_filter.KalmanFilter()
         self.tracks = []
+        self.states = TrackStates()
 
         self.counter_classes = []
         for i in range(num_classes):
@@ -54,8 +62,22 @@ class Tracker:
 
         This function should be called once every time step, before `update`.
         """
-        for track in self.tracks:
-            track.predict(self.kf)
+        if not self.batch_kalman:
+            for track in self.tracks:
+                track.predict(self.kf)
+            return
+
+        n = self.states.size
+        if n == 0:
+            return
+
+        states = self.states
+        states.means[:n], states.covariances[:n] = self.kf.multi_predict(states.means[:n], states.covariances[:n])
+        states.projected_means[:n], states.cholesky_factors[:n] = self.kf.multi_cholesky_project(
+            states.means[:n], states.covariances[:n])
+        states.projected[:n] = True
+        states.ages[:n] += 1
+        states.times_since_update[:n] += 1
 
     def update(self, detections):
         """Perform measurement update and track management.
@@ -70,13 +92,32 @@ class Tracker:
         matches, unmatched_tracks, unmatched_detections = self._match(detections)
 
         # Update track set.
-        for track_idx, detection_idx in matches:
-            self.tracks[track_idx].update(self.kf, detections[detection_idx])
+        if self.batch_kalman and len(matches) > 0:
+            # track i is in row i of the state arrays
+            rows = np.asarray([track_idx for track_idx, _ in matches], np.int64)
+            measurements = np.asarray([detections[detection_idx].to_xyah() for _, detection_idx in matches])
+            states = self.states
+            states.means[rows], states.covariances[rows] = self.kf.multi_update(
+                states.means[rows], states.covariances[rows], measurements)
+            states.projected[rows] = False
+            states.times_since_update[rows] = 0
+            for track_idx, detection_idx in matches:
+                self.tracks[track_idx].mark_hit(detections[detection_idx])
+        else:
+            for track_idx, detection_idx in matches:
+                self.tracks[track_idx].update(self.kf, detections[detection_idx])
         for track_idx in unmatched_tracks:
             self.tracks[track_idx].mark_missed()
         for detection_idx in unmatched_detections:
             self._initiate_track(detections[detection_idx])
-        self.tracks = [t for t in self.tracks if not t.is_deleted()]
+
+        alive = [t for t in self.tracks if not t.is_deleted()]
+        if len(alive) < len(self.tracks):
+            for track in self.tracks:
+                if track.is_deleted():
+                    track.detach()
+            self.states.compact(alive)
+        self.tracks = alive
 
         # Update distance metric.
         active_targets = [t.track_id for t in self.tracks if t.is_confirmed()]
@@ -125,7 +166,9 @@ class Tracker:
     def _initiate_track(self, detection):
         mean, covariance = self.kf.initiate(detection.to_xyah())
         class_name = detection.get_class()
-        self.tracks.append(Track(mean, covariance, self.counter_classes[detection.get_class_id()],
-                                 self.n_init, self.max_age, detection.confidence,
-                                 detection.feature, class_name, detection.get_class_id()))
+        track = Track(mean, covariance, self.counter_classes[detection.get_class_id()],
+                      self.n_init, self.max_age, detection.confidence,
+                      detection.feature, class_name, detection.get_class_id())
+        self.states.append(track)
+        self.tracks.append(track)
         self.counter_classes[detection.get_class_id()] += 1
@@ -4,7 +4,6 @@ from PIL import ImageDraw, ImageFont, Image
 from matplotlib.colors import rgb_to_hsv, hsv_to_rgb
 import cv2
 import base64
-from io import BytesIO
 from libs.detection.yolo.v3.layers import yolo_v3, yolo_v3_tiny
 from libs.detection.yolo.v4.layers import yolo_v4
 from libs.detection.caps.layers import yolo_caps
@@ -12,18 +11,47 @@ import config
 from libs.deepsort import preprocessing, nn_matching
 from libs.deepsort.detection import Detection
 from libs.deepsort.tracker import Tracker
-from libs.deepsort.box_encoder import create_box_encoder
+from libs.deepsort.box_encoder import create_box_encoder, CachedBoxEncoder
+from libs.batching import DynamicBatcher
+from libs.inference import compile_inference_function
 import matplotlib.pyplot as plt
 import time
 
 
 class ObjectDetection:
-    def __init__(self, clazz, box, score, num=-1, img=None):
+    """
+    A detected object. Instead of an encoded crop it may keep a reference to
+    the frame it was found in, the crop is then cut from the frame only when
+    it is needed. The frame must not be modified afterwards.
+    """
+
+    def __init__(self, clazz, box, score, num=-1, img=None, frame=None, margin=15):
         self.clazz = clazz
         self.box = box
         self.score = score
         self.num = num
         self.img = img
+        self.frame = frame
+        self.margin = margin
+
+    def get_region(self):
+        """Return a view of the frame with the box and its margin, clipped at the frame boundaries."""
+        height, width = self.frame.shape[:2]
+        x1, y1, x2, y2 = self.box
+        x1, y1 = max(int(x1) - self.margin, 0), max(int(y1) - self.margin, 0)
+        x2, y2 = min(int(x2) + self.margin, width), min(int(y2) + self.margin, height)
+        return self.frame[y1:y2, x1:x2]
+
+    def get_crop(self, size, region=(0., 0., 1., 1.)):
+        """Cut the relative `region` (y1, x1, y2, x2) out of the box with its margin and resize it to `size` (height, width)."""
+        img = self.get_region()
+        height, width = img.shape[:2]
+        if height == 0 or width == 0:
+            return None
+        y1, x1, y2, x2 = region
+        img = img[int(y1 * height):max(int(y2 * height), int(y1 * height) + 1),
+                  int(x1 * width):max(int(x2 * width), int(x1 * width) + 1)]
+        return cv2.resize(img, (size[1], size[0]), interpolation=cv2.INTER_AREA)
 
     def get_class(self):
         return self.clazz
@@ -38,6 +66,12 @@ class ObjectDetection:
         return self.num
 
     def get_img(self):
+        """Return the base64 encoded JPEG crop of the object."""
+        if self.img is None and self.frame is not None:
+            region = self.get_region()
+            if region.size > 0:
+                _, buffered = cv2.imencode('.jpg', region)
+                self.img = base64.b64encode(buffered.tobytes()).decode('utf-8')
         return self.img
 
     def __repr__(self):
@@ -47,8 +81,54 @@ class ObjectDetection:
         return f'ObjectDetection[class = {self.clazz}, box = {self.box}, score = {self.score}, num = {self.num}]'
 
 
+class TrackingContext:
+    """
+    Tracking state of one stream: the tracker with its track counter, the
+    gallery of the appearance metric and the feature cache. Contexts are
+    created by `ObjectDetectionModel.create_context` and share the weights of
+    the model, so any number of streams can be tracked on one loaded model.
+    """
+
+    def __init__(self, encoder, max_cosine_distance=0.7, nn_budget=100, feature_cache=False,
+                 feature_cache_iou_threshold=0.9, feature_cache_max_reuse=5):
+        self.metric = nn_matching.NearestNeighborDistanceMetric('cosine', max_cosine_distance, nn_budget)
+        self.tracker = Tracker(self.metric, num_classes=1)
+
+        # embeddings of confirmed tracks with a stable box are reused instead of re-encoded
+        self.feature_cache = None
+        self.encoder = encoder
+        if feature_cache:
+            self.feature_cache = CachedBoxEncoder(encoder, iou_threshold=feature_cache_iou_threshold,
+                                                  max_reuse=feature_cache_max_reuse)
+            self.encoder = self.feature_cache
+
+        self.frames = 0
+        self.detections = 0
+
+    def update(self, detections):
+        """Advance the tracker by one frame with the detections of the frame and return the current tracks."""
+        self.tracker.predict()
+        self.tracker.update(detections)
+        if self.feature_cache is not None:
+            self.feature_cache.update(self.tracker.tracks)
+
+        self.frames += 1
+        self.detections += len(detections)
+        return self.tracker.tracks
+
+    def get_stats(self):
+        stats = {'frames': self.frames, 'detections': self.detections, 'tracks': len(self.tracker.tracks),
+                 'confirmed': sum(track.is_confirmed() for track in self.tracker.tracks),
+                 'gallery': len(self.metric.slots)}
+        if self.feature_cache is not None:
+            stats['feature_cache'] = self.feature_cache.get_stats()
+        return stats
+
+
 class ObjectDetectionModel:
-    def __init__(self, model='yolo3-person', weights=config.object_detection_weights, use_tracking=True, classes=None, size=416):
+    def __init__(self, model='yolo3-person', weights=config.object_detection_weights, use_tracking=True, classes=None, size=416,
+                 max_batch_size=1, max_latency=0.01, feature_cache=False, feature_cache_iou_threshold=0.9,
+                 feature_cache_max_reuse=5):
         if classes is None:
             classes = []
 
@@ -61,112 +141,147 @@ class ObjectDetectionModel:
         self.size = size
         self.use_tracking = use_tracking
 
+        cmap = plt.get_cmap('tab20b')
+        self.colors = [cmap(i)[:3] for i in np.linspace(0, 1, 20)]
+
         if model == 'yolo3':
             anchors = get_anchors(config.yolo_v3_anchors)
-            self.object_detection_model = yolo_v3(anchors, size=size, channels=3, classes=self.num_classes)
+            self.object_detection_model = yolo_v3(anchors, size=size, channels=3, classes=self.num_classes, batched=True)
         elif model == 'yolo4':
             anchors = get_anchors(config.yolo_v4_anchors)
-            self.object_detection_model = yolo_v4(anchors, size=size, channels=3, classes=self.num_classes)
+            self.object_detection_model = yolo_v4(anchors, size=size, channels=3, classes=self.num_classes, batched=True)
         elif model == 'yolo3_tiny':
             anchors = get_anchors(config.yolo_v3_tiny_anchors)
-            self.object_detection_model = yolo_v3_tiny(anchors, size=size, channels=3, classes=self.num_classes)
+            self.object_detection_model = yolo_v3_tiny(anchors, size=size, channels=3, classes=self.num_classes, batched=True)
         elif model == 'yolo2':
             raise Exception('undefined yolo2')
         elif model == 'yolo_caps':
             anchors = get_anchors(config.yolo_v3_anchors)
-            self.object_detection_model = yolo_caps(anchors, size=size, channels=3, classes=self.num_classes)
+            self.object_detection_model = yolo_caps(anchors, size=size, channels=3, classes=self.num_classes, batched=True)
         else:
             raise Exception(f'undefined {model}')
 
         self.object_detection_model.load_weights(weights).expect_partial()
-        self.object_detection_model.make_predict_function()
         freeze_all(self.object_detection_model)
-        self.object_detection_model.predict(np.zeros((1, size, size, 3)))
+        self.inference = compile_inference_function(self.object_detection_model, (size, size, 3))
+
+        # frames of all streams that share this model are gathered into dynamic batches
+        self.detection_batcher = None
+        if max_batch_size > 1:
+            self.detection_batcher = DynamicBatcher(self.predict_batch_for_detection, max_batch_size=max_batch_size,
+                                                    max_latency=max_latency, name='detection-batcher')
 
         if use_tracking:
-            max_cosine_distance = 0.7
             self.nms_max_overlap = 1.0
-            nn_budget = None
             self.size = size
 
-            self.encoder = create_box_encoder(config.deepsort_model, batch_size=1)
-            self.metric = nn_matching.NearestNeighborDistanceMetric('cosine', max_cosine_distance, nn_budget)
-            self.tracker = Tracker(self.metric, num_classes=1)
+            # the re-ID encoder is shared by all tracking contexts
+            self.encoder = create_box_encoder(config.deepsort_model, batch_size=32)
+            self.context_params = {'max_cosine_distance': 0.7, 'nn_budget': 100, 'feature_cache': feature_cache,
+                                   'feature_cache_iou_threshold': feature_cache_iou_threshold,
+                                   'feature_cache_max_reuse': feature_cache_max_reuse}
+            # used when no context is passed, e.g. by single stream scripts
+            self.context = self.create_context()
+
+    def create_context(self):
+        """Create the tracking state of a new stream."""
+        if not self.use_tracking:
+            raise Exception('tracking is disabled')
+        return TrackingContext(self.encoder, **self.context_params)
 
     def clear_tracker(self):
         if self.use_tracking:
-            self.tracker = Tracker(self.metric, num_classes=1)
+            self.context = self.create_context()
 
-    def predict_for_detection(self, image):
+    def preprocess(self, image):
         img = tf.expand_dims(image, 0)
-        img = transform_images(img, self.size)
+        return transform_images(img, self.size)
 
-        boxes, scores, classes, nums = self.object_detection_model.predict(img)
-        return boxes, scores, classes, nums
+    def detect(self, img):
+        if self.detection_batcher is not None:
+            return self.detection_batcher(img)
 
-    def predict_for_tracking(self, image):
+        boxes, scores, classes, nums = [output.numpy() for output in self.inference(img)]
+        return boxes[0], scores[0], classes[0], nums[0]
+
+    def predict_for_detection(self, image):
+        return self.detect(self.preprocess(image))
+
+    def predict_batch_for_detection(self, images):
+        """Run detection once for a list of transformed images of shape (1, size, size, 3).
+
+        Returns a list with (boxes, scores, classes, nums) for every image.
+        """
+        img = tf.concat(images, axis=0)
+
+        boxes, scores, classes, nums = [output.numpy() for output in self.inference(img)]
+        return [(boxes[i], scores[i], classes[i], nums[i]) for i in range(len(images))]
+
+    def predict_for_tracking(self, image, context=None):
+        context = self.context if context is None else context
         boxes, scores, classes, nums = self.predict_for_detection(image)
         names = []
         for i in range(len(classes)):
             names.append(self.class_names[int(classes[i])])
         names = np.array(names)
         converted_boxes = convert_boxes(image, boxes)
-        features = self.encoder(image, converted_boxes)
+        features = context.encoder(image, converted_boxes)
         detections = [Detection(bbox, score, class_name, int(class_id), feature)
                       for bbox, score, class_name, class_id, feature
                       in zip(converted_boxes, scores, names, classes, features)
                       if class_name == 'person' or class_name == 'человек']
 
         # call the tracker
-        self.tracker.predict()
-        self.tracker.update(detections)
-        return self.tracker.tracks, boxes, scores, classes, nums
+        tracks = context.update(detections)
+        return tracks, boxes, scores, classes, nums
+
+    def track(self, image, outputs, context=None):
+        """Update the tracker of `context` with the detector outputs for `image` and return the current tracks."""
+        context = self.context if context is None else context
+        boxes, scores, classes, nums = outputs
+
+        names = []
+        for i in range(len(classes)):
+            names.append(self.class_names[int(classes[i])])
+        names = np.array(names)
+        converted_boxes = convert_boxes(image, boxes)
+        features = context.encoder(image, converted_boxes)
+        detections = [Detection(bbox, score, class_name, int(class_id), feature)
+                      for bbox, score, class_name, class_id, feature
+                      in zip(converted_boxes, scores, names, classes, features)
+                      if class_name == 'person' or class_name == 'человек']
+
+        # run non-maxima suppression
+        boxes_for_tracking = np.array([d.tlwh for d in detections])
+        scores_for_tracking = np.array([d.confidence for d in detections])
+        classes_for_tracking = np.array([d.class_name for d in detections])
+
+        indices = preprocessing.non_max_suppression(boxes_for_tracking, classes_for_tracking, self.nms_max_overlap, scores_for_tracking)
+        detections = [detections[i] for i in indices]
+
+        # call the tracker
+        return context.update(detections)
+
+    def draw(self, image, outputs, tracks=None):
+        img = np.array(image)
+        if tracks is None:
+            return analyze_detection_outputs(img, outputs, self.class_names, self.colors)
+        return analyze_tracks_outputs(img, tracks, self.colors)
 
     def detect_image(self, image):
         t1 = time.time()
-        boxes, scores, classes, nums = self.predict_for_detection(image)
+        outputs = self.predict_for_detection(image)
         t2 = time.time()
         print(f'time detection: {t2 * 1000 - t1 * 1000} ms')
 
-        cmap = plt.get_cmap('tab20b')
-        colors = [cmap(i)[:3] for i in np.linspace(0, 1, 20)]
-
-        img = np.array(image)
-        if not self.use_tracking:
-            img, det_info = analyze_detection_outputs(img, (boxes, scores, classes, nums),
-                                                      self.class_names, colors)
-        else:
-            # img, det_info = analyze_detection_outputs(img, (boxes, scores, classes, nums),
-            #                                           self.class_names, colors, ignore_classes=set(self.class_names))
+        tracks = None
+        if self.use_tracking:
             t1 = time.time()
-            names = []
-            for i in range(len(classes)):
-                names.append(self.class_names[int(classes[i])])
-            names = np.array(names)
-            converted_boxes = convert_boxes(image, boxes)
-            features = self.encoder(image, converted_boxes)
-            detections = [Detection(bbox, score, class_name, int(class_id), feature)
-                          for bbox, score, class_name, class_id, feature
-                          in zip(converted_boxes, scores, names, classes, features)
-                          if class_name == 'person' or class_name == 'человек']
-
-            # run non-maxima suppression
-            boxes_for_tracking = np.array([d.tlwh for d in detections])
-            scores_for_tracking = np.array([d.confidence for d in detections])
-            classes_for_tracking = np.array([d.class_name for d in detections])
-
-            indices = preprocessing.non_max_suppression(boxes_for_tracking, classes_for_tracking, self.nms_max_overlap, scores_for_tracking)
-            detections = [detections[i] for i in indices]
-
-            # call the tracker
-            self.tracker.predict()
-            self.tracker.update(detections)
+            tracks = self.track(image, outputs)
             t2 = time.time()
             print(f'time tracking: {t2 * 1000 - t1 * 1000} ms')
 
-            img, det_info = analyze_tracks_outputs(img, self.tracker.tracks, colors)
-
-        return img, det_info
+        return self.draw(image, outputs, tracks)
 
 
 def freeze_to(model, num_layer, frozen=True):
@@ -515,8 +630,7 @@ def analyze_detection_outputs(img, outputs, class_names, colors, ignore_classes=
 
 
 def analyze_tracks_outputs(img, tracks, colors):
-    before_img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
-    before_img = Image.fromarray(before_img)
+    frame = img
     img = Image.fromarray(img)
     font = ImageFont.truetype(font=config.font_cv,
                               size=np.floor((3e-2 * img.size[1] + 0.5)).astype('int32'))
@@ -542,15 +656,8 @@ def analyze_tracks_outputs(img, tracks, colors):
         else:
             text_origin = np.array([x1, y1 + 5])
 
-        img_crop = before_img.crop((int(x1) - 15, int(y1) - 15, int(x2) + 15, int(y2) + 15))
-
-        buffered = BytesIO()
-        img_crop.save(buffered, format="JPEG")
-        img_bytes = base64.b64encode(buffered.getvalue())
-        img_str = img_bytes.decode('utf-8')
-
         object_detection.append(ObjectDetection(predicted_class, (x1, y1, x2, y2), track.score,
-                                                track.track_id, img_str))
+                                                track.track_id, frame=frame))
 
         # My kingdom for a good redistributable image drawing library.
         color = colors[int(track.track_id) % len(colors)]
@@ -588,7 +695,8 @@ def yolo_boxes(pred, anchors, classes):
     return bbox, objectness, class_probs, pred_box
 
 
-def yolo_nms(outputs, yolo_max_boxes=30, yolo_iou_threshold=0.5, yolo_score_threshold=0.5, num_classes=80):
+def yolo_nms(outputs, yolo_max_boxes=30, yolo_iou_threshold=0.5, yolo_score_threshold=0.5, num_classes=80,
+             batched=False):
     # boxes, conf, type
     b, c, t = [], [], []
 
@@ -615,4 +723,7 @@ def yolo_nms(outputs, yolo_max_boxes=30, yolo_iou_threshold=0.5, yolo_score_thre
         score_threshold=yolo_score_threshold
     )
 
+    if batched:
+        return boxes, scores, classes, valid_detections
+
     return boxes[0], scores[0], classes[0], valid_detections[0]
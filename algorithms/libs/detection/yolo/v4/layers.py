@@ -14,7 +14,7 @@ def yolo_output(x_in, filters, anchors, classes, name=None):
     return tf.keras.Model(inputs, x, name=name)(x_in)
 
 
-def yolo_v4(anchors, size=None, channels=3, classes=80, training=False):
+def yolo_v4(anchors, size=None, channels=3, classes=80, training=False, batched=False):
     masks = np.array([[6, 7, 8], [3, 4, 5], [0, 1, 2]])
 
     x = inputs = Input([size, size, channels], name='input')
@@ -79,7 +79,7 @@ def yolo_v4(anchors, size=None, channels=3, classes=80, training=False):
     boxes_1 = Lambda(lambda inp: yolo_boxes(inp, anchors[masks[1]], classes), name='yolo_boxes_1')(output_1)
     boxes_2 = Lambda(lambda inp: yolo_boxes(inp, anchors[masks[2]], classes), name='yolo_boxes_2')(output_2)
 
-    outputs = Lambda(lambda inp: yolo_nms(inp, num_classes=classes), name='yolo_nms')((boxes_0[:3], boxes_1[:3], boxes_2[:3]))
+    outputs = Lambda(lambda inp: yolo_nms(inp, num_classes=classes, batched=batched), name='yolo_nms')((boxes_0[:3], boxes_1[:3], boxes_2[:3]))
 
     return Model(inputs, outputs, name='yolo4')
 
@@ -0,0 +1,18 @@
+import tensorflow as tf
+
+
+def compile_inference_function(model, input_shape, dtype=tf.float32):
+    """Trace `model` once into a graph function with a fixed input signature.
+
+    Only the batch dimension is left free, so calling the function with any
+    batch of `input_shape` inputs never retraces and skips the tf.data and
+    callback machinery that `model.predict` builds on every call.
+    """
+    signature = [tf.TensorSpec((None, *input_shape), dtype, name='input')]
+
+    @tf.function(input_signature=signature)
+    def inference(x):
+        return model(x, training=False)
+
+    inference.get_concrete_function()
+    return inference
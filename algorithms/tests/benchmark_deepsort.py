@@ -0,0 +1,193 @@
+import timeit
+import numpy as np
+from libs.deepsort import kalman_filter, linear_assignment, iou_matching, preprocessing, nn_matching
+from libs.deepsort.detection import Detection
+from libs.deepsort.track import Track
+from libs.deepsort.box_encoder import extract_image_patch, extract_image_patches
+
+
+def create_scene(n_tracks, n_detections, seed=0):
+    rng = np.random.RandomState(seed)
+    kf = kalman_filter.KalmanFilter()
+
+    tracks = []
+    for i in range(n_tracks):
+        tlwh = np.r_[rng.uniform(0, 1920, 2), rng.uniform(30, 60), rng.uniform(80, 160)]
+        detection = Detection(tlwh, 1., 'person', 0, np.zeros(128))
+        mean, covariance = kf.initiate(detection.to_xyah())
+        mean[4:6] = rng.normal(0, 3, 2)
+        tracks.append(Track(mean, covariance, i + 1, 3, 30, 1.))
+
+    detections = []
+    for i in range(n_detections):
+        track = tracks[i % n_tracks]
+        tlwh = track.to_tlwh() + np.r_[rng.normal(0, 5, 2), 0, 0]
+        detections.append(Detection(tlwh, 1., 'person', 0, np.zeros(128)))
+
+    return kf, tracks, detections
+
+
+def gate_cost_matrix_loop(kf, cost_matrix, tracks, detections, track_indices, detection_indices):
+    # the per-track gating used before batching, kept as a reference
+    gating_threshold = kalman_filter.chi2inv95[4]
+    measurements = np.asarray([detections[i].to_xyah() for i in detection_indices])
+    for row, track_idx in enumerate(track_indices):
+        track = tracks[track_idx]
+        gating_distance = kf.gating_distance(track.mean, track.covariance, measurements)
+        cost_matrix[row, gating_distance > gating_threshold] = linear_assignment.INFTY_COST
+    return cost_matrix
+
+
+def benchmark_gating(sizes=(10, 50, 100, 200, 500), number=20):
+    print('gate_cost_matrix, tracks x detections')
+    for n in sizes:
+        kf, tracks, detections = create_scene(n, n)
+        track_indices = list(range(len(tracks)))
+        detection_indices = list(range(len(detections)))
+        cost_matrix = np.zeros((len(tracks), len(detections)))
+
+        loop = gate_cost_matrix_loop(kf, cost_matrix.copy(), tracks, detections, track_indices, detection_indices)
+        batched = linear_assignment.gate_cost_matrix(kf, cost_matrix.copy(), tracks, detections,
+                                                     track_indices, detection_indices)
+        assert np.array_equal(loop, batched)
+
+        loop_ms = timeit.timeit(lambda: gate_cost_matrix_loop(kf, cost_matrix.copy(), tracks, detections,
+                                                              track_indices, detection_indices),
+                                number=number) * 1000 / number
+        batched_ms = timeit.timeit(lambda: linear_assignment.gate_cost_matrix(kf, cost_matrix.copy(), tracks,
+                                                                              detections, track_indices,
+                                                                              detection_indices),
+                                   number=number) * 1000 / number
+
+        mean = np.asarray([t.mean for t in tracks])
+        covariance = np.asarray([t.covariance for t in tracks])
+        projected_mean, cholesky_factor = kf.multi_cholesky_project(mean, covariance)
+        for i, track in enumerate(tracks):
+            track.projection = (projected_mean[i], cholesky_factor[i])
+        cached_ms = timeit.timeit(lambda: linear_assignment.gate_cost_matrix(kf, cost_matrix.copy(), tracks,
+                                                                             detections, track_indices,
+                                                                             detection_indices),
+                                  number=number) * 1000 / number
+
+        print(f'{n:4d} x {n:4d}: loop {loop_ms:8.2f} ms, batched {batched_ms:7.2f} ms, '
+              f'batched with cached projection {cached_ms:7.2f} ms')
+
+
+def iou_cost_loop(tracks, detections, track_indices, detection_indices):
+    # the per-track IoU cost used before vectorization, kept as a reference
+    cost_matrix = np.zeros((len(track_indices), len(detection_indices)))
+    for row, track_idx in enumerate(track_indices):
+        if tracks[track_idx].time_since_update > 1:
+            cost_matrix[row, :] = linear_assignment.INFTY_COST
+            continue
+
+        bbox = tracks[track_idx].to_tlwh()
+        candidates = np.asarray([detections[i].tlwh for i in detection_indices])
+        cost_matrix[row, :] = 1. - iou_matching.iou(bbox, candidates)
+    return cost_matrix
+
+
+def non_max_suppression_loop(boxes, max_bbox_overlap, scores):
+    # the suppression loop used before the pair-wise overlap matrix, kept as a reference
+    boxes = boxes.astype(np.float64)
+    pick = []
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = boxes[:, 2] + boxes[:, 0], boxes[:, 3] + boxes[:, 1]
+    area = (x2 - x1 + 1) * (y2 - y1 + 1)
+    idxs = np.argsort(scores)
+    while len(idxs) > 0:
+        last = len(idxs) - 1
+        i = idxs[last]
+        pick.append(i)
+        w = np.maximum(0, np.minimum(x2[i], x2[idxs[:last]]) - np.maximum(x1[i], x1[idxs[:last]]) + 1)
+        h = np.maximum(0, np.minimum(y2[i], y2[idxs[:last]]) - np.maximum(y1[i], y1[idxs[:last]]) + 1)
+        overlap = (w * h) / area[idxs[:last]]
+        idxs = np.delete(idxs, np.concatenate(([last], np.where(overlap > max_bbox_overlap)[0])))
+    return pick
+
+
+def benchmark_iou(sizes=(10, 50, 100, 200, 500), number=20):
+    print('iou_cost, tracks x detections')
+    for n in sizes:
+        kf, tracks, detections = create_scene(n, n)
+        for track in tracks[::4]:
+            track.time_since_update = 2
+        indices = list(range(n))
+
+        assert np.allclose(iou_cost_loop(tracks, detections, indices, indices),
+                           iou_matching.iou_cost(tracks, detections, indices, indices))
+
+        loop_ms = timeit.timeit(lambda: iou_cost_loop(tracks, detections, indices, indices),
+                                number=number) * 1000 / number
+        vectorized_ms = timeit.timeit(lambda: iou_matching.iou_cost(tracks, detections, indices, indices),
+                                      number=number) * 1000 / number
+        print(f'{n:4d} x {n:4d}: loop {loop_ms:8.2f} ms, vectorized {vectorized_ms:7.2f} ms')
+
+    print('non_max_suppression, detections')
+    for n in sizes:
+        rng = np.random.RandomState(n)
+        boxes = np.c_[rng.uniform(0, 1920, (n, 2)), rng.uniform(30, 60, n), rng.uniform(80, 160, n)]
+        scores = rng.uniform(0.5, 1., n)
+
+        assert non_max_suppression_loop(boxes, 0.5, scores) == \
+            preprocessing.non_max_suppression(boxes, None, 0.5, scores)
+
+        loop_ms = timeit.timeit(lambda: non_max_suppression_loop(boxes, 0.5, scores),
+                                number=number) * 1000 / number
+        vectorized_ms = timeit.timeit(lambda: preprocessing.non_max_suppression(boxes, None, 0.5, scores),
+                                      number=number) * 1000 / number
+        print(f'{n:4d}: loop {loop_ms:8.2f} ms, pair-wise overlap {vectorized_ms:7.2f} ms')
+
+
+def distance_loop(samples, features, targets):
+    # the per-target distance over sample lists used before the gallery, kept as a reference
+    cost_matrix = np.zeros((len(targets), len(features)))
+    for i, target in enumerate(targets):
+        cost_matrix[i, :] = nn_matching._nn_cosine_distance(samples[target], features)
+    return cost_matrix
+
+
+def benchmark_metric(sizes=(10, 50, 100, 200), budget=100, number=10):
+    print(f'NearestNeighborDistanceMetric.distance, targets x detections, budget {budget}')
+    for n in sizes:
+        rng = np.random.RandomState(n)
+        targets = list(range(n))
+        metric = nn_matching.NearestNeighborDistanceMetric('cosine', 0.7, budget)
+        samples = {target: [] for target in targets}
+        for _ in range(budget):
+            features = rng.normal(size=(n, 128)).astype(np.float32)
+            metric.partial_fit(features, np.asarray(targets), targets)
+            for target, feature in zip(targets, features):
+                samples[target].append(feature)
+        detections = rng.normal(size=(n, 128)).astype(np.float32)
+
+        assert np.allclose(distance_loop(samples, detections, targets), metric.distance(detections, targets),
+                           atol=1e-5)
+
+        loop_ms = timeit.timeit(lambda: distance_loop(samples, detections, targets), number=number) * 1000 / number
+        gallery_ms = timeit.timeit(lambda: metric.distance(detections, targets), number=number) * 1000 / number
+        fit_ms = timeit.timeit(lambda: metric.partial_fit(detections, np.asarray(targets), targets),
+                               number=number) * 1000 / number
+        print(f'{n:4d} x {n:4d}: loop {loop_ms:8.2f} ms, gallery {gallery_ms:7.2f} ms, partial_fit {fit_ms:6.2f} ms')
+
+
+def benchmark_patches(sizes=(1, 10, 50, 100), patch_shape=(128, 64), number=10):
+    print('re-ID patch extraction, boxes in a 1920x1080 frame')
+    image = np.random.randint(0, 255, (1080, 1920, 3)).astype(np.uint8)
+    for n in sizes:
+        _, _, detections = create_scene(n, n)
+        boxes = np.asarray([d.tlwh for d in detections])
+        out = np.zeros((n, *patch_shape, 3), np.uint8)
+
+        loop_ms = timeit.timeit(lambda: [extract_image_patch(image, box, patch_shape) for box in boxes],
+                                number=number) * 1000 / number
+        batched_ms = timeit.timeit(lambda: extract_image_patches(image, boxes, patch_shape, out),
+                                   number=number) * 1000 / number
+        print(f'{n:4d}: loop {loop_ms:8.2f} ms, crop_and_resize {batched_ms:7.2f} ms')
+
+
+if __name__ == '__main__':
+    benchmark_gating()
+    benchmark_iou()
+    benchmark_metric()
+    benchmark_patches()
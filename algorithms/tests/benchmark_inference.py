@@ -0,0 +1,98 @@
+import time
+import numpy as np
+import tensorflow as tf
+import config
+from libs.detection.utils import get_anchors
+from libs.detection.yolo.v3.layers import yolo_v3
+from PIL import Image
+from libs.capsnets.utils import video_capsnet, preprocess_video, VideoClassCapsNetModel
+from libs.capsnets.streaming import StreamingVideoClassifier
+from libs.inference import compile_inference_function
+from libs.deepsort.box_encoder import ImageEncoder
+
+
+def benchmark(fn, x, n_calls=50, n_warmup=5):
+    for _ in range(n_warmup):
+        fn(x)
+    t1 = time.time()
+    for _ in range(n_calls):
+        fn(x)
+    t2 = time.time()
+    return (t2 - t1) * 1000 / n_calls
+
+
+def compare(name, model, input_shape, n_calls=50):
+    x = np.random.uniform(0., 1., (1, *input_shape)).astype(np.float32)
+    inference = compile_inference_function(model, input_shape)
+
+    predict_ms = benchmark(model.predict, x, n_calls)
+    call_ms = benchmark(lambda inp: model(inp, training=False), x, n_calls)
+    inference_ms = benchmark(inference, x, n_calls)
+
+    print(f'{name}: model.predict {predict_ms:.2f} ms, eager call {call_ms:.2f} ms, '
+          f'tf.function {inference_ms:.2f} ms, per-call overhead saved {predict_ms - inference_ms:.2f} ms')
+
+
+def compare_box_encoder(sizes=(1, 3, 8, 20, 32, 64), n_calls=20):
+    encoder = ImageEncoder(config.deepsort_model)
+    for n in sizes:
+        patches = np.random.randint(0, 255, (n, *encoder.image_shape)).astype(np.uint8)
+        benchmark(encoder, patches, n_calls)
+
+    for size, stats in encoder.get_stats().items():
+        print(f'deepsort encoder, bucket {size:2d}: {stats["latency_ms"]:.2f} ms per run, '
+              f'{stats["patches_per_second"]:.0f} patches/s')
+
+
+def preprocess_video_loop(video, crop_size=(112, 112)):
+    # the per-frame float64 path used before, scipy.misc.imresize is a PIL bilinear resize
+    video_res = np.zeros((video.shape[0], 120, 160, 3))
+    for f in range(video.shape[0]):
+        video_res[f] = np.asarray(Image.fromarray(video[f]).resize((160, 120), Image.BILINEAR))
+    h_crop_start, w_crop_start = int((120 - crop_size[0]) / 2), int((160 - crop_size[1]) / 2)
+    video_cropped = video_res[:, h_crop_start:h_crop_start + crop_size[0], w_crop_start:w_crop_start + crop_size[1], :]
+    return video_cropped / 255.
+
+
+def compare_video_preprocessing(n_calls=50):
+    video = np.random.randint(0, 255, (8, 320, 240, 3)).astype(np.uint8)
+    out = np.zeros((8, 112, 112, 3), np.float32)
+
+    loop_ms = benchmark(preprocess_video_loop, video, n_calls)
+    vectorized_ms = benchmark(lambda v: preprocess_video(v, out=out), video, n_calls)
+    print(f'video preprocessing 8x320x240x3: per-frame loop {loop_ms:.2f} ms, vectorized {vectorized_ms:.2f} ms per clip')
+
+
+def compare_streaming(n_frames=24):
+    model = VideoClassCapsNetModel()
+    frames = np.random.randint(0, 255, (n_frames, 112, 112, 3)).astype(np.uint8)
+
+    t1 = time.time()
+    full = [model.predict_batch([frames[i - 7:i + 1]])[0][1] for i in range(7, n_frames)]
+    full_ms = (time.time() - t1) * 1000 / len(full)
+
+    for cached_layers in (1, 2, 3):
+        classifier = StreamingVideoClassifier(model, cached_layers)
+        for frame in frames[:7]:
+            classifier.push(0, frame)
+        t1 = time.time()
+        scores = [classifier.push(0, frame) for frame in frames[7:]]
+        streaming_ms = (time.time() - t1) * 1000 / len(full)
+
+        error = max(abs(s[np.argmax(s)] - confidence) for s, confidence in zip(scores, full))
+        print(f'video capsnet per frame: full clip {full_ms:.2f} ms, streaming with {cached_layers} cached layers '
+              f'{streaming_ms:.2f} ms, max confidence difference {error:.2e}')
+
+
+if __name__ == '__main__':
+    tf.config.set_visible_devices([], 'GPU')
+
+    yolo = yolo_v3(get_anchors(config.yolo_v3_anchors), size=416, channels=3, classes=80, batched=True)
+    compare('yolo3 416x416x3', yolo, (416, 416, 3))
+
+    capsnet = video_capsnet(num_classes=len(open(config.event_classes_en).readlines()))
+    compare('video capsnet 8x112x112x3', capsnet, (8, 112, 112, 3), n_calls=10)
+
+    compare_box_encoder()
+    compare_video_preprocessing()
+    compare_streaming()
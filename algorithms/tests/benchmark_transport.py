@@ -0,0 +1,73 @@
+import io
+import sys
+import time
+import numpy as np
+import config
+from api.service import classification_transport
+from api.service.classification_transport import create_transport
+
+
+def measure(fn, n_calls):
+    fn()
+    wall, cpu = time.time(), time.process_time()
+    for _ in range(n_calls):
+        fn()
+    return (time.time() - wall) * 1000 / n_calls, (time.process_time() - cpu) * 1000 / n_calls
+
+
+def encode_npz(clips):
+    buf = io.BytesIO()
+    np.savez_compressed(buf, *clips)
+    buf.seek(0)
+    npzfile = np.load(buf)
+    return [npzfile[key] for key in npzfile.files]
+
+
+def encode_raw(clips):
+    data = clips.tobytes()
+    return np.frombuffer(data, np.uint8).reshape(clips.shape)
+
+
+def encode_shm(clips, slab):
+    np.ndarray(clips.shape, np.uint8, buffer=slab.buf)[:] = clips
+    return np.ndarray(clips.shape, np.uint8, buffer=slab.buf).copy()
+
+
+def benchmark_encoding(n_clips=(1, 4, 16), clip_shape=(8, 112, 112, 3), n_calls=20):
+    print('serialization only, client and server side, per clip')
+    slab = None
+    if classification_transport.shared_memory is not None:
+        slab = classification_transport.shared_memory.SharedMemory(create=True, size=max(n_clips) * int(np.prod(clip_shape)))
+
+    for n in n_clips:
+        clips = np.random.randint(0, 255, (n, *clip_shape)).astype(np.uint8)
+        results = [('npz', measure(lambda: encode_npz(clips), n_calls)),
+                   ('raw', measure(lambda: encode_raw(clips), n_calls))]
+        if slab is not None:
+            results.append(('shm', measure(lambda: encode_shm(clips, slab), n_calls)))
+
+        print(f'{n:3d} clips: ' + ', '.join(f'{name} {wall / n:.2f} ms wall {cpu / n:.2f} ms cpu'
+                                            for name, (wall, cpu) in results))
+
+    if slab is not None:
+        slab.close()
+        slab.unlink()
+
+
+def benchmark_transports(transports, n_clips=(1, 4, 16), clip_shape=(8, 112, 112, 3), n_calls=10):
+    print(f'end-to-end classification against {config.video_classification_addr}, client side, per clip')
+    for name in transports:
+        transport = create_transport(name)
+        for n in n_clips:
+            clips = np.random.randint(0, 255, (n, *clip_shape)).astype(np.uint8)
+            wall, cpu = measure(lambda: transport.classify(clips), n_calls)
+            print(f'{name:10s} {n:3d} clips: {wall / n:.2f} ms wall, {cpu / n:.2f} ms cpu')
+        transport.close()
+
+
+if __name__ == '__main__':
+    benchmark_encoding()
+
+    # e.g. python -m tests.benchmark_transport npz raw shm in_process
+    if len(sys.argv) > 1:
+        benchmark_transports(sys.argv[1:])
@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import os
+import threading
+import time
+from threading import Thread, Event
+import numpy as np
+import aiohttp
+from aiohttp import web
+from api.async_streaming import stream_mjpeg
+from api.model.source_registry import SourceRegistry
+
+BOUNDARY = b'--frame'
+
+
+class SyntheticSession:
+    """Stands in for the tracking session of a source: one thread broadcasting a frame of `frame_size` bytes at `fps`."""
+
+    def __init__(self, source, fps, frame_size):
+        self.source = source
+        self.fps = fps
+        self.frame = b'\xff\xd8' + os.urandom(frame_size) + b'\xff\xd9'
+        self.stop_event = Event()
+
+        self.thread = Thread(target=self.run, name=f'synthetic-{source.key}')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        next_time = time.time()
+        while not self.stop_event.is_set():
+            next_time += 1. / self.fps
+            self.stop_event.wait(max(next_time - time.time(), 0))
+            self.source.broadcast(self.frame)
+
+    def is_closed(self):
+        return self.stop_event.is_set()
+
+    def close(self):
+        self.stop_event.set()
+
+
+async def start_synthetic_server(port, fps, frame_size):
+    registry = SourceRegistry(close_session=SyntheticSession.close)
+
+    def open_session(source):
+        return SyntheticSession(source, fps, frame_size)
+
+    async def video(request):
+        subscription = registry.subscribe(request.query.get('source', '0'), open_session)
+        try:
+            return await stream_mjpeg(request, subscription)
+        finally:
+            registry.unsubscribe(subscription)
+
+    app = web.Application()
+    app.router.add_get('/video', video)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, 'localhost', port).start()
+    return runner
+
+
+async def client(session, url, duration):
+    """Read a stream for `duration` seconds, returns the number of frames and the time to the first one."""
+    start_time = time.time()
+    frames, first_frame_time, tail = 0, None, b''
+    async with session.get(url) as response:
+        async for chunk in response.content.iter_any():
+            data = tail + chunk
+            frames += data.count(BOUNDARY)
+            tail = data[-len(BOUNDARY) + 1:]
+            if first_frame_time is None and frames > 0:
+                first_frame_time = time.time() - start_time
+            if time.time() - start_time > duration:
+                break
+    return frames, first_frame_time
+
+
+async def run_level(url, n_clients, duration, n_sources=None):
+    timeout = aiohttp.ClientTimeout(total=None)
+    if n_sources is not None:
+        # the clients are spread over the synthetic sources
+        urls = [f'{url}?source={i % n_sources}' for i in range(n_clients)]
+    else:
+        urls = [url] * n_clients
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0), timeout=timeout) as session:
+        results = await asyncio.gather(*[client(session, url, duration) for url in urls], return_exceptions=True)
+
+    failed = sum(isinstance(result, Exception) for result in results)
+    results = [result for result in results if not isinstance(result, Exception)]
+    fps = np.array([frames / duration for frames, _ in results]) if results else np.zeros(1)
+    first = [first_frame_time for _, first_frame_time in results if first_frame_time is not None]
+    print(f'{n_clients:5d} clients: {fps.sum():8.1f} fps total, {fps.mean():6.1f} mean, {fps.min():6.1f} min '
+          f'fps per client, first frame p95 {np.percentile(first, 95) * 1000 if first else float("nan"):7.1f} ms, '
+          f'{failed} failed, {threading.active_count()} threads')
+
+
+async def main(args):
+    runner = None
+    url = args.url
+    n_sources = None
+    if url is None:
+        runner = await start_synthetic_server(args.port, args.fps, args.frame_size)
+        url = f'http://localhost:{args.port}/video'
+        n_sources = args.sources
+        print(f'{n_sources} synthetic sources: {args.fps} fps, {args.frame_size} bytes per frame')
+
+    for n_clients in args.clients:
+        await run_level(url, n_clients, args.duration, n_sources)
+
+    if runner is not None:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    # e.g. python -m tests.load_test_mjpeg --clients 1 8 64 256
+    # or against a running server started with SERVER_MODE=aiohttp:
+    # python -m tests.load_test_mjpeg --url "http://localhost:5000/video_camera/user/process?video_addr=..."
+    parser = argparse.ArgumentParser(description='Concurrent MJPEG clients against one server')
+    parser.add_argument('--url', default=None, help='stream to read, by default an in-process synthetic server')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16, 64, 256])
+    parser.add_argument('--duration', type=float, default=5.)
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--fps', type=float, default=25.)
+    parser.add_argument('--frame-size', type=int, default=40000)
+    parser.add_argument('--sources', type=int, default=4, help='number of synthetic sources')
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
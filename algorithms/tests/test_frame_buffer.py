@@ -0,0 +1,59 @@
+import time
+from threading import Thread, Event
+from api.model.frame_buffer import FrameBuffer, ADAPTIVE
+
+
+class Producer:
+    """Puts a frame into the buffer every `interval` seconds on its own thread."""
+
+    def __init__(self, buffer, interval):
+        self.buffer = buffer
+        self.interval = interval
+        self.stop_event = Event()
+
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        next_time = time.time()
+        while not self.stop_event.is_set():
+            self.buffer.put(next_time)
+            next_time += self.interval
+            time.sleep(max(next_time - time.time(), 0))
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def consume(buffer, duration, work_time):
+    """Read frames for `duration` seconds spending `work_time` seconds on each one."""
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        buffer.get(timeout=1.)
+        time.sleep(work_time)
+
+
+def test_adaptive_step_follows_consumer():
+    buffer = FrameBuffer(size=32, policy=ADAPTIVE, max_frame_age=None)
+    producer = Producer(buffer, interval=0.01)
+
+    # the consumer needs five capture intervals per frame, so about every fifth frame is delivered
+    consume(buffer, duration=1.5, work_time=0.05)
+    assert buffer.get_stats()['step'] >= 3
+
+    # once the consumer is fast again, the waiting for the skipped frames does not keep the step up
+    consume(buffer, duration=1.5, work_time=0.005)
+    assert buffer.get_stats()['step'] == 1
+
+    delivered = buffer.get_stats()['delivered']
+    consume(buffer, duration=0.5, work_time=0.005)
+    producer.stop()
+    # every frame is delivered again, i.e. about 50 frames in 0.5 seconds
+    assert buffer.get_stats()['delivered'] - delivered >= 35
+
+
+if __name__ == '__main__':
+    test_adaptive_step_follows_consumer()
+    print('ok')
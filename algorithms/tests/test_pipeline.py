@@ -0,0 +1,28 @@
+import time
+from api.model.pipeline import FramePipeline
+
+
+def test_source_is_read_on_demand():
+    reads = []
+
+    def source():
+        reads.append(time.time())
+        return reads[-1]
+
+    def slow(read_time):
+        time.sleep(0.05)
+        return read_time
+
+    pipeline = FramePipeline(source, [('slow', slow), ('fast', lambda read_time: read_time)], queue_size=1)
+    ages = [time.time() - pipeline.get(timeout=1.) for _ in range(20)]
+    pipeline.stop()
+
+    # besides the delivered items at most one item per queue and stage is in flight
+    assert len(reads) <= 20 + 2 * len(pipeline.queues)
+    # the source is read when the slow stage is about to take an item, so an item is only as old as its processing
+    assert sum(ages[5:]) / len(ages[5:]) < 0.075
+
+
+if __name__ == '__main__':
+    test_source_is_read_on_demand()
+    print('ok')
@@ -0,0 +1,135 @@
+import time
+from api.model.rabbitmq_publisher import RabbitMQPublisher, DROP_OLDEST, DROP_NEWEST
+
+
+class FakeBroker:
+    """A local stand-in for the broker: keeps published bodies and fails on request."""
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.events = 0
+        self.down = False
+        # the publish call with this number fails and closes the connection
+        self.fail_at = None
+
+    def connect(self):
+        if self.down:
+            raise ConnectionError('broker is down')
+        self.connections += 1
+        return FakeConnection(self)
+
+
+class FakeConnection:
+    def __init__(self, broker):
+        self.broker = broker
+        self.is_open = True
+
+    def channel(self):
+        return FakeChannel(self)
+
+    def process_data_events(self, time_limit=0):
+        self.broker.events += 1
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeChannel:
+    def __init__(self, connection):
+        self.connection = connection
+
+    @property
+    def is_open(self):
+        return self.connection.is_open
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        broker = self.connection.broker
+        if broker.fail_at is not None:
+            broker.fail_at -= 1
+            if broker.fail_at < 0:
+                broker.fail_at = None
+                self.connection.close()
+                raise ConnectionError('connection lost')
+        broker.messages.append(body)
+
+
+def wait_until(condition, timeout=2.):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def create_publisher(broker, **kwargs):
+    return RabbitMQPublisher('amqp://localhost', 'exchange', connection_factory=broker.connect,
+                             reconnect_interval=0.01, **kwargs)
+
+
+def test_batching():
+    broker = FakeBroker()
+    publisher = create_publisher(broker, batch_size=4, flush_interval=10.)
+    for i in range(8):
+        publisher.publish(str(i))
+
+    assert wait_until(lambda: len(broker.messages) == 8)
+    assert broker.messages == [str(i).encode('utf-8') for i in range(8)]
+    assert publisher.get_stats()['batches'] == 2
+    assert broker.connections == 1
+    publisher.stop()
+
+
+def test_flush_interval():
+    broker = FakeBroker()
+    publisher = create_publisher(broker, batch_size=64, flush_interval=0.05)
+    publisher.publish(b'a')
+
+    assert wait_until(lambda: broker.messages == [b'a'])
+    # the idle connection is serviced for heartbeats
+    assert wait_until(lambda: broker.events > 0)
+    publisher.stop()
+
+
+def test_drop_policy():
+    for drop_policy, expected in ((DROP_OLDEST, [b'2', b'3', b'4']), (DROP_NEWEST, [b'0', b'1', b'2'])):
+        broker = FakeBroker()
+        broker.down = True
+        publisher = create_publisher(broker, batch_size=64, flush_interval=10., buffer_size=3,
+                                     drop_policy=drop_policy)
+        for i in range(5):
+            publisher.publish(str(i))
+        assert publisher.get_stats()['dropped'] == 2
+
+        broker.down = False
+        publisher.stop()
+        assert broker.messages == expected, drop_policy
+
+
+def test_reconnect():
+    broker = FakeBroker()
+    broker.fail_at = 2
+    publisher = create_publisher(broker, batch_size=5, flush_interval=0.05)
+    for i in range(5):
+        publisher.publish(str(i))
+
+    # the two messages published before the failure are not sent again
+    assert wait_until(lambda: len(broker.messages) == 5)
+    assert broker.messages == [str(i).encode('utf-8') for i in range(5)]
+    assert broker.connections == 2
+
+    stats = publisher.get_stats()
+    assert stats['published'] == 5 and stats['failed'] == 1
+    publisher.stop()
+
+
+if __name__ == '__main__':
+    test_batching()
+    test_flush_interval()
+    test_drop_policy()
+    test_reconnect()
+    print('ok')
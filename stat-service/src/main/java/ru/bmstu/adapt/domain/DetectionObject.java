@@ -43,4 +43,11 @@ public class DetectionObject {
     @DateTimeFormat(iso = DateTimeFormat.ISO.DATE_TIME)
     private LocalDateTime createdDate;
 
+    @DateTimeFormat(iso = DateTimeFormat.ISO.DATE_TIME)
+    private LocalDateTime endedDate;
+
+    private Integer[] lastBox;
+
+    private Integer lastNumFrame;
+
 }
\ No newline at end of file
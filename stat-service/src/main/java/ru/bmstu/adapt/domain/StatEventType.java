@@ -1,5 +1,9 @@
 package ru.bmstu.adapt.domain;
 
 public enum StatEventType {
-    OBJECT_DETECTION
-}
\ No newline at end of file
+    OBJECT_DETECTION,
+    TRACK_STARTED,
+    TRACK_UPDATED,
+    EVENT_CLASSIFIED,
+    TRACK_ENDED
+}
@@ -12,7 +12,9 @@ import org.springframework.amqp.rabbit.annotation.RabbitListener;
 import org.springframework.stereotype.Component;
 
 import java.time.LocalDateTime;
+import java.util.EnumSet;
 import java.util.List;
+import java.util.Set;
 
 import static ru.bmstu.adapt.config.RabbitConfig.STAT_FANOUT_QUEUE_NAME;
 
@@ -21,6 +23,9 @@ import static ru.bmstu.adapt.config.RabbitConfig.STAT_FANOUT_QUEUE_NAME;
 @RequiredArgsConstructor
 public class StatEventListener {
 
+    private static final Set<StatEventType> DETECTION_EVENT_TYPES = EnumSet.of(StatEventType.OBJECT_DETECTION,
+            StatEventType.TRACK_STARTED, StatEventType.TRACK_UPDATED, StatEventType.EVENT_CLASSIFIED);
+
     private final ObjectMapper objectMapper;
     private final DetectionObjectService detectionObjectService;
 
@@ -29,8 +34,10 @@ public class StatEventListener {
         try {
             StatEvent statEvent = objectMapper.readValue(message.getBody(), StatEvent.class);
 
-            if (statEvent.getType() == StatEventType.OBJECT_DETECTION) {
+            if (DETECTION_EVENT_TYPES.contains(statEvent.getType())) {
                 saveDetectionObject(statEvent);
+            } else if (statEvent.getType() == StatEventType.TRACK_ENDED) {
+                endTrack(statEvent);
             }
         } catch (Exception exc) {
             log.error("Stat-event was not generated -> {}", exc.getMessage());
@@ -44,14 +51,9 @@ public class StatEventListener {
         Double score = (Double) statEvent.getAttributes().get("score");
         Integer numFrame = (Integer) statEvent.getAttributes().get("iteration");
         Integer numObject = (Integer) statEvent.getAttributes().get("numObject");
-        List boxList = (List) statEvent.getAttributes().get("box");
+        Integer[] box = getBox(statEvent);
         String image = (String) statEvent.getAttributes().get("image");
 
-        Integer[] box = new Integer[4];
-        for (int i = 0; i < boxList.size(); i++) {
-            box[i] = ((Double) boxList.get(i)).intValue();
-        }
-
         DetectionObject detectionObject = DetectionObject.builder()
                 .userId(userId)
                 .detectionProcessId(detectionProcessId)
@@ -67,4 +69,23 @@ public class StatEventListener {
         detectionObjectService.save(detectionObject);
     }
 
+    private void endTrack(StatEvent statEvent) {
+        String userId = (String) statEvent.getAttributes().get("userId");
+        String detectionProcessId = (String) statEvent.getAttributes().get("detectionProcessId");
+        Integer numFrame = (Integer) statEvent.getAttributes().get("iteration");
+        Integer numObject = (Integer) statEvent.getAttributes().get("numObject");
+
+        detectionObjectService.endTrack(userId, detectionProcessId, numObject, getBox(statEvent), numFrame);
+    }
+
+    private Integer[] getBox(StatEvent statEvent) {
+        List boxList = (List) statEvent.getAttributes().get("box");
+
+        Integer[] box = new Integer[4];
+        for (int i = 0; i < boxList.size(); i++) {
+            box[i] = ((Number) boxList.get(i)).intValue();
+        }
+        return box;
+    }
+
 }
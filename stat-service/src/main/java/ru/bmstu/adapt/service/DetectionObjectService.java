@@ -8,6 +8,7 @@ import org.springframework.data.domain.Sort;
 import org.springframework.data.mongodb.core.MongoTemplate;
 import org.springframework.data.mongodb.core.query.Criteria;
 import org.springframework.data.mongodb.core.query.Query;
+import org.springframework.data.mongodb.core.query.Update;
 import org.springframework.stereotype.Service;
 
 import java.time.LocalDateTime;
@@ -43,6 +44,24 @@ public class DetectionObjectService {
         mongoTemplate.save(detectionObject);
     }
 
+    public void endTrack(String userId, String detectionProcessId, Integer numObject, Integer[] lastBox,
+                         Integer lastNumFrame) {
+        Query query = new Query();
+        query.addCriteria(new Criteria().andOperator(
+                Criteria.where("userId").is(userId),
+                Criteria.where("detectionProcessId").is(detectionProcessId),
+                Criteria.where("numObject").is(numObject),
+                Criteria.where("endedDate").exists(false)
+        ));
+
+        Update update = new Update()
+                .set("endedDate", LocalDateTime.now())
+                .set("lastBox", lastBox)
+                .set("lastNumFrame", lastNumFrame);
+
+        mongoTemplate.updateMulti(query, update, DetectionObject.class);
+    }
+
     public DetectionObject findById(String id) {
         return mongoTemplate.findById(id, DetectionObject.class);
     }